@@ -0,0 +1,46 @@
+"""add per-topic indexes for mirrored messages
+
+Revision ID: a3c7e2d94b10
+Revises: f81821ebfc23
+Create Date: 2026-10-15 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3c7e2d94b10'
+down_revision: Union[str, None] = 'f81821ebfc23'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# only adds indexes the code doesn't need: safe to apply while the bot is serving
+online = True
+
+
+def upgrade() -> None:
+    # topic cleanup finds all mirrors of a topic from either side
+    if op.get_context().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            op.create_index(
+                'idx_mirrors_user_thread', 'mirrored_messages', ['user_chat_id', 'thread_id'],
+                unique=False, postgresql_include=['admin_chat_id', 'admin_msg_id'],
+                postgresql_concurrently=True, if_not_exists=True,
+            )
+            op.create_index(
+                'idx_mirrors_admin_thread', 'mirrored_messages', ['admin_chat_id', 'thread_id'],
+                unique=False, postgresql_include=['user_chat_id', 'user_msg_id'],
+                postgresql_concurrently=True, if_not_exists=True,
+            )
+    else:
+        op.create_index('idx_mirrors_user_thread', 'mirrored_messages',
+                        ['user_chat_id', 'thread_id'], unique=False, if_not_exists=True)
+        op.create_index('idx_mirrors_admin_thread', 'mirrored_messages',
+                        ['admin_chat_id', 'thread_id'], unique=False, if_not_exists=True)
+
+
+def downgrade() -> None:
+    op.drop_index('idx_mirrors_admin_thread', table_name='mirrored_messages')
+    op.drop_index('idx_mirrors_user_thread', table_name='mirrored_messages')
@@ -0,0 +1,36 @@
+"""add covering index for tgusers lookups by thread
+
+Revision ID: c41d8e7a2f63
+Revises: a3c7e2d94b10
+Create Date: 2026-10-15 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41d8e7a2f63'
+down_revision: Union[str, None] = 'a3c7e2d94b10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# only adds indexes the code doesn't need: safe to apply while the bot is serving
+online = True
+
+
+def upgrade() -> None:
+    # SQLite has no INCLUDE, so the read columns go into the key
+    op.create_index(
+        'idx_tgusers_thread_cover', 'tgusers',
+        ['thread_id', 'user_id', 'subject', 'banned', 'first_replied', 'can_message'],
+        unique=False, if_not_exists=True,
+    )
+    # the covering index starts with thread_id, so it serves these lookups too
+    op.drop_index('ix_tgusers_thread_id', table_name='tgusers', if_exists=True)
+
+
+def downgrade() -> None:
+    op.create_index('ix_tgusers_thread_id', 'tgusers', ['thread_id'], unique=False, if_not_exists=True)
+    op.drop_index('idx_tgusers_thread_cover', table_name='tgusers')
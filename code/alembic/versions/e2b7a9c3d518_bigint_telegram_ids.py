@@ -0,0 +1,88 @@
+"""64-bit telegram ids, tgusers keyed by user_id
+
+Revision ID: e2b7a9c3d518
+Revises: c41d8e7a2f63
+Create Date: 2026-10-15 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.sql import false
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2b7a9c3d518'
+down_revision: Union[str, None] = 'c41d8e7a2f63'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# SQLite INTEGER is 64-bit already, and only INTEGER PRIMARY KEY is the rowid
+TG_ID = sa.BigInteger().with_variant(sa.Integer(), 'sqlite')
+TG_ID_COLUMNS = {
+    'adminstats': ['admin_id'],
+    'messages_to_delete': ['chat_id', 'msg_id'],
+    'mirrored_messages': ['admin_chat_id', 'admin_msg_id', 'user_chat_id', 'user_msg_id', 'thread_id'],
+}
+TGUSER_COLUMNS = ('user_id, full_name, username, thread_id, last_user_msg_at, '
+                  'subject, banned, first_replied, can_message')
+
+
+def _tgusers_columns() -> list:
+    return [
+        sa.Column('full_name', sa.String(length=129), nullable=True),
+        sa.Column('username', sa.String(length=32), nullable=True),
+        sa.Column('thread_id', TG_ID, nullable=True),
+        sa.Column('last_user_msg_at', sa.DateTime(), nullable=True),
+        sa.Column('subject', sa.String(length=32), nullable=True),
+        sa.Column('banned', sa.Boolean(), nullable=False),
+        sa.Column('first_replied', sa.Boolean(), server_default=false(), nullable=False),
+        sa.Column('can_message', sa.Boolean(), server_default=false(), nullable=False),
+    ]
+
+
+def _replace_tgusers(new_table: sa.Table) -> None:
+    op.execute(f'INSERT INTO {new_table.name} ({TGUSER_COLUMNS}) SELECT {TGUSER_COLUMNS} FROM tgusers')
+    op.drop_table('tgusers')
+    op.rename_table(new_table.name, 'tgusers')
+
+
+def _alter_tg_ids(type_, existing_type) -> None:
+    if op.get_context().dialect.name == 'sqlite':  # column types are just affinities there
+        return
+    for table, columns in TG_ID_COLUMNS.items():
+        for column in columns:
+            op.alter_column(table, column, type_=type_, existing_type=existing_type)
+
+
+def upgrade() -> None:
+    _alter_tg_ids(sa.BigInteger(), sa.Integer())
+
+    # user_id becomes the primary key, the surrogate id and its index go away
+    _replace_tgusers(op.create_table(
+        'tgusers_new',
+        sa.Column('user_id', TG_ID, primary_key=True, autoincrement=False),
+        *_tgusers_columns(),
+    ))
+    op.create_index(
+        'idx_tgusers_thread_cover', 'tgusers',
+        ['thread_id', 'user_id', 'subject', 'banned', 'first_replied', 'can_message'], unique=False,
+    )
+
+
+def downgrade() -> None:
+    _replace_tgusers(op.create_table(
+        'tgusers_old',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        *_tgusers_columns(),
+    ))
+    op.create_index('ix_tgusers_id', 'tgusers', ['id'], unique=False)
+    op.create_index('ix_tgusers_user_id', 'tgusers', ['user_id'], unique=True)
+    op.create_index(
+        'idx_tgusers_thread_cover', 'tgusers',
+        ['thread_id', 'user_id', 'subject', 'banned', 'first_replied', 'can_message'], unique=False,
+    )
+
+    _alter_tg_ids(sa.Integer(), sa.BigInteger())
@@ -0,0 +1,43 @@
+"""merge heads, add covering index for mirrored messages lookups
+
+Revision ID: f5a2cffa989d
+Revises: 465cfc43f9f7, 80d0c6db4f5a
+Create Date: 2026-10-15 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f5a2cffa989d'
+down_revision: Union[str, None] = ('465cfc43f9f7', '80d0c6db4f5a')
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# only adds indexes the code doesn't need: safe to apply while the bot is serving
+online = True
+
+
+def upgrade() -> None:
+    # admin edits/deletes look up the user copy by the admin message,
+    # so let the index carry everything they read
+    if op.get_context().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            op.execute(
+                'CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_mirrors_admin_cover '
+                'ON mirrored_messages (admin_chat_id, admin_msg_id) '
+                'INCLUDE (user_chat_id, user_msg_id, thread_id)'
+            )
+    else:
+        op.create_index(
+            'idx_mirrors_admin_cover',
+            'mirrored_messages',
+            ['admin_chat_id', 'admin_msg_id', 'user_chat_id', 'user_msg_id', 'thread_id'],
+            unique=False, if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    op.drop_index('idx_mirrors_admin_cover', table_name='mirrored_messages')
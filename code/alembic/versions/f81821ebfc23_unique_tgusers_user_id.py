@@ -0,0 +1,29 @@
+"""make tgusers.user_id unique
+
+Revision ID: f81821ebfc23
+Revises: f5a2cffa989d
+Create Date: 2026-10-15 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f81821ebfc23'
+down_revision: Union[str, None] = 'f5a2cffa989d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # keep the latest row of each user, as TgUser.add always did
+    op.execute('DELETE FROM tgusers WHERE id NOT IN (SELECT MAX(id) FROM tgusers GROUP BY user_id)')
+    op.drop_index('ix_tgusers_user_id', table_name='tgusers')
+    op.create_index('ix_tgusers_user_id', 'tgusers', ['user_id'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_tgusers_user_id', table_name='tgusers')
+    op.create_index('ix_tgusers_user_id', 'tgusers', ['user_id'], unique=False)
@@ -8,9 +8,17 @@ import asyncio
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from dotenv import load_dotenv
 from aiogram import Dispatcher
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
 
 from support_bot import SupportBot, destruct_messages, stats_to_admin_chat, register_handlers
 
+try:  # faster event loop, optional
+    import uvloop
+except ImportError:
+    uvloop = None
+
 
 BASE_DIR = Path(__file__).resolve().parent
 BOTS = ()
@@ -54,6 +62,20 @@ async def start() -> None:
     """
     Create bot instances and run them within a dispatcher
     """
+    online = []  # bots migrated while serving
+    for bot in BOTS:
+        if bot.cfg['migration_mode'] != 'async':
+            continue
+        if await _can_migrate_online(bot):
+            online.append(bot)
+        else:
+            logger.warning('DB of %s has migrations the code depends on, applying them before start', bot.name)
+            await asyncio.to_thread(migrate, bot)
+
+    await asyncio.gather(*[b.db.init() for b in BOTS])
+    migrations = [asyncio.create_task(migrate_async(b)) for b in online]
+    for task in migrations:
+        task.add_done_callback(_log_task_failure)
     await start_jobs(BOTS)
 
     dp = Dispatcher()
@@ -61,6 +83,10 @@ async def start() -> None:
 
     logger.info('Started bots: %s', ', '.join([b.name for b in BOTS]))
     await dp.start_polling(*BOTS, polling_timeout=30)
+    await asyncio.gather(*migrations, return_exceptions=True)  # failures are logged by the callback
+    await asyncio.gather(*[b.wait_background() for b in BOTS])
+    await asyncio.gather(*[b.gsheets.close() for b in BOTS])
+    await asyncio.gather(*[b.db.dispose() for b in BOTS])
 
 
 def cmd_makemigrations() -> None:
@@ -83,16 +109,66 @@ def cmd_makemigrations() -> None:
     stream.read()
 
 
+def _migrate_cmd(bot: SupportBot) -> str | None:
+    if 'sql' in bot.cfg['db_engine'].lower():
+        envvar = 'MBSB_SQLALCHEMY_URL=' + bot.cfg['db_url']
+        return f'{envvar} alembic upgrade head'
+
+
+def migrate(bot: SupportBot) -> None:
+    """
+    Migrate a bot DB, blocking until it's done
+    """
+    if cmd := _migrate_cmd(bot):
+        logger.info('Migrating DB for %s', bot.name)
+        stream = os.popen(cmd)
+        stream.read()
+        if status := stream.close():
+            code = os.waitstatus_to_exitcode(status)
+            raise RuntimeError(f'Migrating DB for {bot.name} failed with exit code {code}')
+
+
+async def _can_migrate_online(bot: SupportBot) -> bool:
+    """
+    Whether all the pending migrations of a bot DB are marked as safe to apply while serving
+    """
+    if not _migrate_cmd(bot):
+        return True
+
+    cfg = Config(str(BASE_DIR / 'alembic.ini'))
+    cfg.set_main_option('script_location', str(BASE_DIR / 'alembic'))
+    script = ScriptDirectory.from_config(cfg)
+    async with bot.db.engine.connect() as conn:
+        current = await conn.run_sync(lambda c: MigrationContext.configure(c).get_current_heads())
+
+    pending = script.iterate_revisions(script.get_heads(), current)
+    return all(getattr(rev.module, 'online', False) for rev in pending)
+
+
+async def migrate_async(bot: SupportBot) -> None:
+    """
+    Migrate a bot DB in a subprocess, while the bot is already serving.
+    Only for migrations which the code doesn't depend on, see _can_migrate_online
+    """
+    if cmd := _migrate_cmd(bot):
+        logger.info('Migrating DB for %s in background', bot.name)
+        proc = await asyncio.create_subprocess_shell(cmd)
+        if await proc.wait():
+            raise RuntimeError(f'Migrating DB for {bot.name} failed with exit code {proc.returncode}')
+        logger.info('Migrating DB for %s done', bot.name)
+
+
+def _log_task_failure(task: asyncio.Task) -> None:
+    if not task.cancelled() and (exc := task.exception()):
+        logger.error('%s', exc, exc_info=exc)
+
+
 def cmd_migrate() -> None:
     """
     Migrate each bot DB
     """
     for bot in BOTS:
-        if 'sql' in bot.cfg['db_engine'].lower():
-            logger.info('Migrating DB for %s', bot.name)
-            envvar = 'MBSB_SQLALCHEMY_URL=' + bot.cfg['db_url']
-            stream = os.popen(f'{envvar} alembic upgrade head')
-            stream.read()
+        migrate(bot)
 
     logger.info('Migrating done')
 
@@ -118,6 +194,12 @@ def main() -> None:
     elif 'migrate' in sys.argv:
         cmd_migrate()
     else:
+        for bot in BOTS:
+            if bot.cfg['migration_mode'] == 'sync':
+                migrate(bot)
+
+        if uvloop:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
         asyncio.run(start())
 
 
@@ -9,7 +9,7 @@ from aiogram.fsm.storage.base import StorageKey
 
 from .callback_data import CBD
 from .const import AdminBtn
-from .informing import handle_error, log
+from .informing import log
 
 
 class BroadcastForm(StatesGroup):
@@ -18,7 +18,6 @@ class BroadcastForm(StatesGroup):
 
 
 @log
-@handle_error
 async def del_old_topics(call: agtypes.CallbackQuery):
     """
     Admin action - delete topics older than 2 weeks,
@@ -32,7 +31,7 @@ async def del_old_topics(call: agtypes.CallbackQuery):
     for tguser in await db.tguser.get_olds():
         if tguser.thread_id:
             try:
-                await bot.delete_forum_topic(bot.cfg['admin_group_id'], tguser.thread_id)
+                await bot.delete_forum_topic(bot.admin_group_id, tguser.thread_id)
                 i += 1
             except TelegramBadRequest as exc:
                 await bot.log_error(exc)
@@ -45,7 +44,6 @@ async def del_old_topics(call: agtypes.CallbackQuery):
 
 
 @log
-@handle_error
 async def admin_broadcast_start(call: agtypes.CallbackQuery, dispatcher: Dispatcher) -> None:
     """
     Start broadcasting flow - ask for a message to broadcast
@@ -60,8 +58,6 @@ async def admin_broadcast_start(call: agtypes.CallbackQuery, dispatcher: Dispatc
     await msg.answer(bot.admin_menu[AdminBtn.broadcast]['answer'])
 
 
-@log
-@handle_error
 async def admin_broadcast_ask_confirm(msg: agtypes.Message, state: FSMContext,
                                       *args, **kwargs) -> None:
     """
@@ -80,11 +76,9 @@ async def admin_broadcast_ask_confirm(msg: agtypes.Message, state: FSMContext,
     await asyncio.sleep(0.1)
 
     text = 'Send this 👆 message to all the bot users?'
-    await send_new_msg_with_keyboard(bot, bot.cfg['admin_group_id'], text, build_confirm_menu())
+    await send_new_msg_with_keyboard(bot, bot.admin_group_id, text, build_confirm_menu())
 
 
-@log
-@handle_error
 async def admin_broadcast_finish(call: agtypes.CallbackQuery, state: FSMContext,
                                  *args, **kwargs) -> None:
     """
@@ -92,7 +86,7 @@ async def admin_broadcast_finish(call: agtypes.CallbackQuery, state: FSMContext,
     """
     msg = call.message
     bot = msg.bot
-    cbd = CBD.unpack(call.data)
+    cbd = CBD.from_call(call)
     state_data = await state.get_data()
 
     if cbd.code == 'yes':
@@ -100,10 +94,10 @@ async def admin_broadcast_finish(call: agtypes.CallbackQuery, state: FSMContext,
         await bot.edit_message_text(chat_id=msg.chat.id, message_id=cbd.msgid, text=text)
 
         success_count = 0
-        users = await bot.db.tguser.get_all()
-        for i, user in enumerate(users):
+        users = await bot.db.tguser.get_active_user_ids()
+        for i, user_id in enumerate(users):
             try:
-                await bot.copy_message(user.user_id, from_chat_id=msg.chat.id,
+                await bot.copy_message(user_id, from_chat_id=msg.chat.id,
                                        message_id=state_data['message'])
                 success_count += 1
             except TelegramForbiddenError as exc:
@@ -1,19 +1,28 @@
+import asyncio
 import logging
 import os
+import time
+from collections import OrderedDict
+from functools import cached_property
 from pathlib import Path
 
 from aiogram import Bot
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import ChatFullInfo
 from google.oauth2.service_account import Credentials
 
-from .buttons import load_toml
-from .const import AdminBtn
+from .buttons import _get_markup, index_menu, kb_templates, load_toml, prepare_answers
+from .const import QUICK_REPLIES_TEXT, AdminBtn
 from .db import SqlDb
+from .gsheets import GSheetsWriter
+from .throttling import KeepAliveSession, RateLimiter
 
 
 BASE_DIR = Path(__file__).resolve().parent.parent
+USER_CHAT_CACHE_TTL = 3600  # seconds
+USER_CHAT_CACHE_SIZE = 10000
 
 
 class SupportBot(Bot):
@@ -24,8 +33,9 @@ class SupportBot(Bot):
         'admin_group_id', 'hello_msg', 'first_reply', 'db_url', 'db_engine',
         'save_messages_gsheets_cred_file', 'save_messages_gsheets_filename', 'hello_ps',
         'destruct_user_messages_for_user', 'destruct_bot_messages_for_user', 'contact_gate_msg',
-        'contact_unlocked_msg', 'stats_topic_id', 'stats_topic_name'
+        'contact_unlocked_msg', 'stats_topic_id', 'stats_topic_name', 'migration_mode'
     )
+    migration_modes = ('sync', 'async', 'skip')
     botdir_file_cfg_vars = ('save_messages_gsheets_cred_file',)
 
     def __init__(self, name: str, logger: logging.Logger):
@@ -34,11 +44,19 @@ class SupportBot(Bot):
 
         self.botdir.mkdir(parents=True, exist_ok=True)
         token, self.cfg = self._read_config()
+        self._unpack_config()
         self._configure_db()
         self._load_menu()
         self._load_quick_replies()
 
-        super().__init__(token, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+        super().__init__(
+            token, session=KeepAliveSession(), default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+        )
+        self.session.middleware(RateLimiter())
+        self._pending_albums: dict[str, list] = {}  # media_group_id: admin messages of an album
+        self.gsheets = GSheetsWriter(self)
+        self._user_chats: OrderedDict[int, tuple[ChatFullInfo, float]] = OrderedDict()  # user_id: (chat, expires_at)
+        self._background: set[asyncio.Task] = set()  # strong refs, so running tasks aren't collected
 
     @property
     def botdir(self) -> Path:
@@ -78,14 +96,12 @@ class SupportBot(Bot):
                 'Это поможет быстрее разобраться и решить вашу проблему.'
             ),
             'stats_topic_name': 'Статистика',
+            'migration_mode': 'sync',
         }
-        stats_file = self.botdir / 'stats_topic_id.txt'
-        if stats_file.exists():
-            cfg['stats_topic_id'] = stats_file.read_text().strip()
-
+        prefix = f'{self.name}_'
+        envvars = {k[len(prefix):]: v for k, v in os.environ.items() if k.startswith(prefix) and v}
         for var in self.cfg_vars:
-            envvar = os.getenv(f'{self.name}_{var.upper()}')
-            if envvar not in (None, ''):
+            if envvar := envvars.get(var.upper()):
                 cfg[var] = envvar
 
         # convert vars with filenames to actual pathes
@@ -100,12 +116,24 @@ class SupportBot(Bot):
                 if not 1 <= cfg[var] <= 47:
                     raise ValueError(f'{var} must be between 1 and 47 (hours)')
 
-        if stats_topic_id := cfg.get('stats_topic_id'):
-            cfg['stats_topic_id'] = int(stats_topic_id)
+        if cfg['migration_mode'] not in self.migration_modes:
+            raise ValueError(f'migration_mode must be one of: {", ".join(self.migration_modes)}')
 
         cfg['hello_msg'] += cfg['hello_ps']
         return os.getenv(f'{self.name}_TOKEN'), cfg
 
+    def _unpack_config(self) -> None:
+        """
+        Keep config values used on every message as typed attributes
+        """
+        group_id = self.cfg.get('admin_group_id')
+        self.admin_group_id = int(group_id) if group_id else None
+        self.first_reply = self.cfg.get('first_reply') or None
+        self.contact_gate_msg = self.cfg.get('contact_gate_msg')
+        self.gsheets_enabled = bool(
+            self.cfg.get('save_messages_gsheets_cred_file') and self.cfg.get('save_messages_gsheets_filename')
+        )
+
     def _configure_db(self) -> None:
         if self.cfg['db_engine'] == 'aiosqlite':
             self.db = SqlDb(self.cfg['db_url'])
@@ -116,23 +144,66 @@ class SupportBot(Bot):
     async def log_error(self, exception: Exception, traceback: bool = True) -> None:
         self._logger.error(str(exception), exc_info=traceback)
 
-    def get_gsheets_creds(self):
+    def spawn(self, coro) -> None:
         """
-        A callback to work with Google Sheets through gspread_asyncio.
+        Run bookkeeping a handler doesn't have to wait for, logging its errors
+        """
+        task = asyncio.create_task(self._log_errors(coro))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _log_errors(self, coro) -> None:
+        try:
+            await coro
+        except Exception as exc:
+            await self.log_error(exc)
+
+    async def wait_background(self) -> None:
+        """
+        Let the spawned tasks finish, e.g. before shutdown
+        """
+        while self._background:
+            await asyncio.gather(*self._background)
+
+    async def get_user_chat(self, user_id: int) -> ChatFullInfo:
         """
+        getChat of a user, cached for an hour: bio and usernames rarely change
+        """
+        now = time.monotonic()
+        if (cached := self._user_chats.get(user_id)) and cached[1] > now:
+            self._user_chats.move_to_end(user_id)
+            return cached[0]
+
+        chat = await self.get_chat(user_id)
+        self._user_chats[user_id] = (chat, now + USER_CHAT_CACHE_TTL)
+        self._user_chats.move_to_end(user_id)
+        if len(self._user_chats) > USER_CHAT_CACHE_SIZE:
+            self._user_chats.popitem(last=False)
+        return chat
+
+    @cached_property
+    def _gsheets_creds(self) -> Credentials:
         cred_file = self.cfg.get('save_messages_gsheets_cred_file', None)
         creds = Credentials.from_service_account_file(cred_file)
-        scoped = creds.with_scopes([
+        return creds.with_scopes([
             "https://spreadsheets.google.com/feeds",
             "https://www.googleapis.com/auth/spreadsheets",
             "https://www.googleapis.com/auth/drive",
         ])
-        return scoped
+
+    def get_gsheets_creds(self) -> Credentials:
+        """
+        A callback to work with Google Sheets through gspread_asyncio.
+        The service account file is read once, on first use.
+        """
+        return self._gsheets_creds
 
     def _load_menu(self) -> None:
         self.menu = load_toml(self.botdir / 'menu.toml')
         if self.menu:
             self.menu['answer'] = self.cfg['hello_msg']
+            prepare_answers(self.menu)
+        self._menu_index = index_menu(self.menu)
 
         self.admin_menu = {
             AdminBtn.broadcast: {'label': '📢 Broadcast to all subscribers',
@@ -141,12 +212,48 @@ class SupportBot(Bot):
             AdminBtn.del_old_topics: {'label': '🧹 Delete topics older than 2 weeks',
                                       'answer': ('Deleting topics older than 2 weeks...')},
         }
+        self._kb_templates = {**kb_templates(self.menu), **kb_templates(self.admin_menu)}
 
     def _load_quick_replies(self) -> None:
         """
         Load optional admin quick-reply scripts from admin_replies.toml
         """
         self.admin_quick_replies = load_toml(self.botdir / 'admin_replies.toml') or {}
+        prepare_answers(self.admin_quick_replies)
+        self._quick_reply_index = index_menu(self.admin_quick_replies)
+        self._kb_templates.update(kb_templates(self.admin_quick_replies))
+        self._quick_reply_markup = (
+            _get_markup(self, self.admin_quick_replies, 0) if self.admin_quick_replies else None
+        )
+
+    async def send_quick_replies(self, thread_id: int) -> None:
+        """
+        Drop the quick-reply keyboard, built once on load, into an admin topic if configured
+        """
+        if self._quick_reply_markup:
+            await self.send_message(
+                self.admin_group_id,
+                QUICK_REPLIES_TEXT,
+                reply_markup=self._quick_reply_markup,
+                disable_web_page_preview=True,
+                message_thread_id=thread_id,
+            )
+
+    @property
+    def _stats_topic_file(self) -> Path:
+        return self.botdir / 'stats_topic_id.txt'
+
+    @cached_property
+    def stats_topic_id(self) -> int | None:
+        """
+        ID of the stats topic: from env, or the one saved by ensure_stats_topic
+        """
+        if thread_id := self.cfg.get('stats_topic_id'):
+            return int(thread_id)
+        try:
+            return int(self._stats_topic_file.read_bytes())
+        except FileNotFoundError:
+            return None
 
     async def ensure_stats_topic(self) -> int:
         """Ensure a dedicated stats topic exists and persist its ID.
@@ -156,17 +263,17 @@ class SupportBot(Bot):
         for future runs.
         """
 
-        if thread_id := self.cfg.get('stats_topic_id'):
-            return int(thread_id)
+        if thread_id := self.stats_topic_id:
+            return thread_id
 
         response = await self.create_forum_topic(
-            self.cfg['admin_group_id'], self.cfg.get('stats_topic_name', 'Статистика'),
+            self.admin_group_id, self.cfg.get('stats_topic_name', 'Статистика'),
         )
         thread_id = response.message_thread_id
 
-        path = self.botdir / 'stats_topic_id.txt'
-        path.write_text(str(thread_id))
-        self.cfg['stats_topic_id'] = thread_id
+        path = self._stats_topic_file
+        await asyncio.to_thread(path.write_text, str(thread_id))
+        self.stats_topic_id = thread_id
         await self.log(f'Created stats topic {thread_id} and saved to {path}')
         return thread_id
 
@@ -174,13 +281,12 @@ class SupportBot(Bot):
         """Send a message to the stats topic, recreating it if the thread ID is invalid."""
         thread_id = message_thread_id or await self.ensure_stats_topic()
         try:
-            await self.send_message(self.cfg['admin_group_id'], text, message_thread_id=thread_id)
+            await self.send_message(self.admin_group_id, text, message_thread_id=thread_id)
             return thread_id
         except TelegramBadRequest:
-            stats_file = self.botdir / 'stats_topic_id.txt'
-            if stats_file.exists():
-                stats_file.unlink()
+            await asyncio.to_thread(self._stats_topic_file.unlink, missing_ok=True)
             self.cfg.pop('stats_topic_id', None)
+            self.stats_topic_id = None
             thread_id = await self.ensure_stats_topic()
-            await self.send_message(self.cfg['admin_group_id'], text, message_thread_id=thread_id)
+            await self.send_message(self.admin_group_id, text, message_thread_id=thread_id)
             return thread_id
@@ -2,18 +2,18 @@
 Display menu with buttons according to menu.toml file,
 handle buttons actions
 """
+import functools
 from pathlib import Path
 
 import aiogram.types as agtypes
 import toml
 from aiogram.exceptions import TelegramBadRequest
-from aiogram.types import InlineKeyboardButton
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from .admin_actions import admin_broadcast_start, del_old_topics
 from .callback_data import CBD
 from .const import MSG_TEXT_LIMIT, AdminBtn, ButtonMode, MenuMode
-from .informing import handle_error, log
 from .topics import create_user_topic
 from .utils import save_for_destruction
 
@@ -27,6 +27,18 @@ def load_toml(path: Path) -> dict | None:
             return toml.load(f)
 
 
+def index_menu(menu: dict | None, path: str='') -> dict[tuple[str, str], dict]:
+    """
+    Flatten a menu tree into a {(path, code): menuitem} lookup.
+    """
+    index = {}
+    for key, val in (menu or {}).items():
+        if isinstance(val, dict):
+            index[(path, key)] = val
+            index.update(index_menu(val, f'{path}.{key}' if path else key))
+    return index
+
+
 class Button:
     """
     Wrapper over an inline keyboard button
@@ -39,11 +51,13 @@ class Button:
         self.answer = _extract_answer(content, empty=empty_answer_allowed)
 
     def _recognize_mode(self) -> None:
+        # submenus usually have an answer too, so children are looked for before subject/answer;
+        # the scan stops at the first child
         if 'link' in self.content:
             self.mode = ButtonMode.link
         elif 'file' in self.content:
             self.mode = ButtonMode.file
-        elif any([isinstance(v, dict) and 'label' in v for v in self.content.values()]):
+        elif any(isinstance(v, dict) and 'label' in v for v in self.content.values()):
             self.mode = ButtonMode.menu
         elif 'subject' in self.content:
             self.mode = ButtonMode.subject
@@ -59,79 +73,135 @@ class Button:
 
 
 def _extract_answer(menu: dict, empty: bool=False) -> str:
+    if (key := '_answer' if empty else '_answer_or_default') in menu:  # precomputed on load
+        return menu[key]
+
     answer = (menu.get('answer') or '')[:MSG_TEXT_LIMIT]
     if not empty:
         answer = answer or '👀'
     return answer
 
 
+def prepare_answers(menu: dict | None) -> None:
+    """
+    Precompute truncated answers of a menu and all its items,
+    to not do it on every button press.
+    """
+    for item in [menu, *index_menu(menu).values()] if menu else ():
+        item['_answer'] = _extract_answer(item, empty=True)
+        item['_answer_or_default'] = _extract_answer(item)
+        if 'subject' in item:
+            item['_subject_answer'] = (
+                item['_answer'] or f'Please write your question about "{item["label"]}"'
+            )
+
+
 def _create_button(content):
     """
-    Button factory
+    Button factory, memoized in the menu item itself since menus live as long as the bot
     """
-    if 'label' in content:
-        return Button(content)
+    if isinstance(content, dict) and 'label' in content:
+        if '_button' not in content:
+            content['_button'] = Button(content)
+        return content['_button']
 
 
-def _get_kb_builder(menu: dict, msgid: int, path: str='') -> InlineKeyboardBuilder:
+def _kb_template(menu: dict, path: str='') -> tuple:
     """
-    Construct an InlineKeyboardBuilder object based on a given menu structure.
+    Precompute a keyboard layout of a menu, as a hashable structure.
+    Everything except msgid is known in advance, so it's done once per menu.
     Args:
         menu (dict): A dict with menu items to display.
-        msgid (int): message_id to place into callback data.
         path (str, optional): A path to remember in callback data,
             to be able to find an answer for a menu item.
+    Returns:
+        A tuple of (method, buttons) steps to replay on InlineKeyboardBuilder,
+        where each button is (text, path, code, url).
     """
-    builder = InlineKeyboardBuilder()
+    steps = []
 
     for key, val in menu.items():
         if btn := _create_button(val):
-            cbd = CBD(path=path, code=key, msgid=msgid).pack()
+            label = btn.content['label']
             if menu.get('menumode') == MenuMode.row:
-                builder.button(text=btn.content['label'], callback_data=cbd)
+                steps.append(('add', ((label, path, key, None),)))
+            elif btn.mode == ButtonMode.link:
+                steps.append(('row', ((label, None, None, btn.content['link']),)))
             else:
-                builder.row(btn.as_inline(cbd))
+                steps.append(('row', ((label, path, key, None),)))
 
     if path:  # build bottom row with navigation
-        btns = []
-        cbd = CBD(path='', code='', msgid=msgid).pack()
-        btns.append(InlineKeyboardButton(text='🏠', callback_data=cbd))
+        btns = [('🏠', '', '', None)]
 
         if '.' in path:
             spl = path.split('.')
-            cbd = CBD(path='.'.join(spl[:-2]), code=spl[-2], msgid=msgid).pack()
-            btns.append(InlineKeyboardButton(text='←', callback_data=cbd))
+            btns.append(('←', '.'.join(spl[:-2]), spl[-2], None))
+
+        steps.append(('row', tuple(btns)))
+
+    return tuple(steps)
+
+
+def kb_templates(menu: dict | None, path: str='') -> dict[tuple[int, str], tuple]:
+    """
+    Precompute keyboard layouts for a menu and all its submenus.
+    Keyed by (id(menu), path), so only long-living menus should be passed here.
+    """
+    if not menu:
+        return {}
 
-        builder.row(*btns)
+    templates = {(id(menu), path): _kb_template(menu, path)}
+    for key, val in menu.items():
+        if (btn := _create_button(val)) and btn.mode == ButtonMode.menu:
+            templates.update(kb_templates(val, f'{path}.{key}' if path else key))
+    return templates
 
-    return builder
 
+@functools.lru_cache(maxsize=1024)
+def _render_kb(template: tuple, msgid: int) -> InlineKeyboardMarkup:
+    """
+    Build an inline keyboard from a precomputed layout,
+    placing msgid into callback data.
+    """
+    builder = InlineKeyboardBuilder()
 
-def _find_menu_item(menu: dict, cbd: CBD) -> [dict, str]:
+    for method, specs in template:
+        btns = []
+        for text, path, code, url in specs:
+            if url:
+                btns.append(InlineKeyboardButton(text=text, url=url))
+            else:
+                cbd = CBD.pack_values(path, code, msgid)
+                btns.append(InlineKeyboardButton(text=text, callback_data=cbd))
+        getattr(builder, method)(*btns)
+
+    return builder.as_markup()
+
+
+def _get_markup(bot, menu: dict, msgid: int, path: str='') -> InlineKeyboardMarkup:
     """
-    Find a button info in bot menu tree by callback data.
+    Inline keyboard for a menu, using the layout precomputed on bot load if any
     """
-    target = menu
-    pathlist = []
-    for lvlcode in cbd.path.split('.'):
-        if lvlcode:
-            pathlist.append(lvlcode)
-            target = target.get(lvlcode)
+    template = bot._kb_templates.get((id(menu), path)) or _kb_template(menu, path)
+    return _render_kb(template, msgid)
 
-    pathlist.append(cbd.code)
-    return target.get(cbd.code), '.'.join(pathlist)
+
+def _find_menu_item(menu_index: dict, cbd: CBD) -> [dict, str]:
+    """
+    Find a button info in a flattened bot menu by callback data.
+    """
+    path = f'{cbd.path}.{cbd.code}' if cbd.path else cbd.code
+    return menu_index.get((cbd.path, cbd.code)), path
 
 
-@log
-@handle_error
 async def user_btn_handler(call: agtypes.CallbackQuery, *args, **kwargs):
     """
     A callback for any button shown to a user.
     """
     msg = call.message
     bot, chat = msg.bot, msg.chat
-    cbd = CBD.unpack(call.data)
-    menuitem, path = _find_menu_item(bot.menu, cbd)
+    cbd = CBD.from_call(call)
+    menuitem, path = _find_menu_item(bot._menu_index, cbd)
     sentmsg = None
     unlocked_prompt = None
 
@@ -146,18 +216,16 @@ async def user_btn_handler(call: agtypes.CallbackQuery, *args, **kwargs):
         elif btn.mode == ButtonMode.answer:
             unlocked_prompt = None
             if menuitem.get('start_chat'):
-                tguser = await bot.db.tguser.get(user=chat)
-                if tguser:
-                    # Reset the flag so the user gets the first auto-reply again
-                    await bot.db.tguser.update(chat.id, can_message=True, first_replied=False)
-                else:
-                    tguser = await bot.db.tguser.add(chat, msg, first_replied=False, can_message=True)
+                # Reset the flag so the user gets the first auto-reply again
+                await bot.db.tguser.upsert(chat, msg, can_message=True, first_replied=False)
 
                 unlocked_text = bot.cfg.get('contact_unlocked_msg')
                 if unlocked_text:
                     unlocked_prompt = await msg.answer(unlocked_text)
             if menuitem.get('as_new_message'):
                 sentmsg = await msg.answer(btn.answer)
+            elif btn.answer in (msg.text, msg.html_text):
+                sentmsg = None  # the same button pressed again, nothing to change
             else:
                 await bot.edit_message_text(
                     chat_id=chat.id,
@@ -176,13 +244,11 @@ async def user_btn_handler(call: agtypes.CallbackQuery, *args, **kwargs):
     return await call.answer()
 
 
-@log
-@handle_error
 async def admin_btn_handler(call: agtypes.CallbackQuery, *args, **kwargs):
     """
     A callback for any button shown in admin group.
     """
-    cbd = CBD.unpack(call.data)
+    cbd = CBD.from_call(call)
 
     if cbd.code == AdminBtn.del_old_topics:
         await del_old_topics(call)
@@ -210,10 +276,9 @@ async def set_subject(bot, user: agtypes.User, menuitem: dict) -> agtypes.Messag
     Set the chosen subject to the user and report that.
     """
     newsubj = menuitem['subject']
-    group_id = bot.cfg['admin_group_id']
+    group_id = bot.admin_group_id
 
-    answer = (menuitem.get('answer') or '')[:MSG_TEXT_LIMIT]
-    answer = answer or f'Please write your question about "{menuitem["label"]}"'
+    answer = menuitem['_subject_answer']
     usrmsg = await bot.send_message(user.id, text=answer)
 
     if tguser := await bot.db.tguser.get(user=user):
@@ -234,7 +299,7 @@ async def edit_or_send_new_msg_with_keyboard(
     """
     text = _extract_answer(menu)
     try:
-        markup = _get_kb_builder(menu, cbd.msgid, path).as_markup()
+        markup = _get_markup(bot, menu, 0, path)  # 0 is this very message, and keeps the markup cached
         return await bot.edit_message_text(chat_id=chat_id, message_id=cbd.msgid, text=text,
                                            reply_markup=markup, disable_web_page_preview=True)
     except TelegramBadRequest:
@@ -248,23 +313,15 @@ async def send_new_msg_with_keyboard(
         message_thread_id: int | None = None) -> agtypes.Message:
     """
     Shortcut to send a message with a keyboard.
+    Buttons carry msgid=0, which is resolved to this message on press.
     """
-    sentmsg = await bot.send_message(
+    return await bot.send_message(
         chat_id,
         text=text,
+        reply_markup=_get_markup(bot, menu, 0, path) if menu else None,
         disable_web_page_preview=True,
         message_thread_id=message_thread_id,
     )
-    if menu:
-        markup = _get_kb_builder(menu, sentmsg.message_id, path).as_markup()
-        await bot.edit_message_text(
-            chat_id=chat_id,
-            message_id=sentmsg.message_id,
-            text=text,
-            reply_markup=markup,
-            disable_web_page_preview=True,
-        )
-    return sentmsg
 
 
 def build_confirm_menu(yes_answer: str='Confirmed', no_answer: str='Canceled') -> dict:
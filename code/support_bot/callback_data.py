@@ -1,4 +1,5 @@
-from aiogram.filters.callback_data import CallbackData
+import aiogram.types as agtypes
+from aiogram.filters.callback_data import MAX_CALLBACK_LENGTH, CallbackData
 
 
 class MenuCallbackData(CallbackData, prefix="_"):
@@ -6,7 +7,43 @@ class MenuCallbackData(CallbackData, prefix="_"):
 
     path: str  # separated by '.'
     code: str  # button identifier after the path
-    msgid: int  # id of a message with this button
+    msgid: int = 0  # id of a message with this button, 0 means the message the button is on
+
+    def pack(self) -> str:
+        """Same format as CallbackData.pack, without the generic model_dump machinery."""
+        return self.pack_values(self.path, self.code, self.msgid)
+
+    @classmethod
+    def pack_values(cls, path: str, code: str, msgid: int = 0) -> str:
+        """Pack callback data from plain values, not building a model at all."""
+        sep = cls.__separator__
+        if sep in path or sep in code:
+            raise ValueError(f'Separator symbol {sep!r} can not be used in {path!r} or {code!r}')
+
+        packed = f'{cls.__prefix__}{sep}{path}{sep}{code}{sep}{msgid}'
+        if len(packed.encode()) > MAX_CALLBACK_LENGTH:
+            raise ValueError(f'Resulted callback data is too long! len({packed!r}.encode()) > {MAX_CALLBACK_LENGTH}')
+        return packed
+
+    @classmethod
+    def unpack(cls, value: str) -> 'MenuCallbackData':
+        """Parse callback data with a plain split, skipping pydantic validation."""
+        prefix, *parts = value.split(cls.__separator__)
+        if prefix != cls.__prefix__:
+            raise ValueError(f'Bad prefix ({prefix!r} != {cls.__prefix__!r})')
+        if len(parts) != 3:
+            raise TypeError(f'Callback data {cls.__name__!r} takes 3 arguments but {len(parts)} were given')
+
+        path, code, msgid = parts
+        return cls.model_construct(path=path, code=code, msgid=int(msgid))
+
+    @classmethod
+    def from_call(cls, call: agtypes.CallbackQuery) -> 'MenuCallbackData':
+        """Unpack callback data of a pressed button, resolving msgid=0 to the actual message."""
+        cbd = cls.unpack(call.data)
+        if not cbd.msgid:
+            cbd.msgid = call.message.message_id
+        return cbd
 
 
 # Backward-compatible alias
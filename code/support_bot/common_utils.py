@@ -4,6 +4,26 @@ import aiogram.types as agtypes
 from .const import MsgType
 
 
+_HTML_UNSAFE = frozenset('&<>"\'')  # chars replaced by html.escape
+
+# content fields of a message, in the order of priority
+_MSG_TYPE_FIELDS = {
+    'photo': MsgType.photo,
+    'video': MsgType.video,
+    'animation': MsgType.animation,
+    'sticker': MsgType.sticker,
+    'audio': MsgType.audio,
+    'voice': MsgType.voice,
+    'document': MsgType.document,
+    'video_note': MsgType.video_note,
+    'contact': MsgType.contact,
+    'location': MsgType.location,
+    'venue': MsgType.venue,
+    'poll': MsgType.poll,
+    'dice': MsgType.dice,
+}
+
+
 def make_short_user_info(user: agtypes.User | None=None, tguser=None) -> str:
     """
     Short text representation of a user
@@ -14,7 +34,9 @@ def make_short_user_info(user: agtypes.User | None=None, tguser=None) -> str:
         user_id = tguser.user_id
         user = tguser
 
-    fullname = html.escape(user.full_name or '')
+    fullname = user.full_name or ''
+    if not _HTML_UNSAFE.isdisjoint(fullname):
+        fullname = html.escape(fullname)
     tech_part = f'@{user.username}, id {user_id}' if user.username else f'id {user_id}'
     return f'{fullname} ({tech_part})'
 
@@ -23,31 +45,8 @@ def determine_msg_type(msg: agtypes.Message) -> str:
     """
     Determine a type of the message by inspecting its content
     """
-    if msg.photo:
-        return MsgType.photo
-    elif msg.video:
-        return MsgType.video
-    elif msg.animation:
-        return MsgType.animation
-    elif msg.sticker:
-        return MsgType.sticker
-    elif msg.audio:
-        return MsgType.audio
-    elif msg.voice:
-        return MsgType.voice
-    elif msg.document:
-        return MsgType.document
-    elif msg.video_note:
-        return MsgType.video_note
-    elif msg.contact:
-        return MsgType.contact
-    elif msg.location:
-        return MsgType.location
-    elif msg.venue:
-        return MsgType.venue
-    elif msg.poll:
-        return MsgType.poll
-    elif msg.dice:
-        return MsgType.dice
-    else:
-        return MsgType.regular_or_other
\ No newline at end of file
+    fields = msg.model_fields_set
+    for field in _MSG_TYPE_FIELDS:
+        if field in fields and getattr(msg, field):
+            return _MSG_TYPE_FIELDS[field]
+    return MsgType.regular_or_other
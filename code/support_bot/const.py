@@ -1,4 +1,6 @@
 MSG_TEXT_LIMIT = 4096
+DELETE_MESSAGES_LIMIT = 100  # message ids per deleteMessages call
+QUICK_REPLIES_TEXT = '⚡ Быстрые ответы для оператора'
 
 
 class MsgType:
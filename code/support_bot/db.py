@@ -1,13 +1,18 @@
+import asyncio
 import datetime
+import logging
+import time
+from collections import Counter, OrderedDict, defaultdict
 from dataclasses import asdict, dataclass
 from pathlib import Path
 
 import aiogram.types as agtypes
 import sqlalchemy as sa
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.engine.row import Row as SaRow
-from sqlalchemy.exc import IntegrityError
-from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
 from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.sql import false
 
 from .enums import ActionName
@@ -15,22 +20,38 @@ from .enums import ActionName
 
 Base = declarative_base()
 BASE_DIR = Path(__file__).resolve().parent.parent
+SQLITE_MAX_VARIABLES = 999
+TGUSER_CACHE_TTL = 60  # seconds
+TGUSER_CACHE_SIZE = 10000
+MSGTODEL_BATCH_SIZE = 200
+MSGTODEL_FLUSH_DELAY = 0.05  # seconds to gather a batch
+ADMINSTATS_FLUSH_INTERVAL = 5  # seconds
+ACTIONS_FLUSH_INTERVAL = 1  # seconds
+
+# Telegram ids need 64 bits. SQLite INTEGER is 64-bit already, and only
+# "INTEGER PRIMARY KEY" (not BIGINT) makes a column the rowid itself
+TG_ID = sa.BigInteger().with_variant(sa.Integer(), 'sqlite')
 
 
 class TgUsers(Base):
     __tablename__ = 'tgusers'
 
-    id = sa.Column(sa.Integer, primary_key=True, index=True)
-    user_id = sa.Column(sa.Integer, index=True, nullable=False)
+    user_id = sa.Column(TG_ID, primary_key=True, autoincrement=False)
     full_name = sa.Column(sa.String(129))
     username = sa.Column(sa.String(32))
-    thread_id = sa.Column(sa.Integer, index=True)
+    thread_id = sa.Column(TG_ID)
     last_user_msg_at = sa.Column(sa.DateTime)
     subject = sa.Column(sa.String(32))
     banned = sa.Column(sa.Boolean, default=False, nullable=False)
     first_replied = sa.Column(sa.Boolean, server_default=false(), nullable=False)
     can_message = sa.Column(sa.Boolean, server_default=false(), nullable=False)
 
+    # user lookups by thread read only these columns, so serve them from the index
+    __table_args__ = (
+        sa.Index('idx_tgusers_thread_cover',
+                 'thread_id', 'user_id', 'subject', 'banned', 'first_replied', 'can_message'),
+    )
+
 
 class ActionStats(Base):
     __tablename__ = 'actionstats'
@@ -49,7 +70,7 @@ class AdminStats(Base):
     __tablename__ = 'adminstats'
 
     id = sa.Column(sa.Integer, primary_key=True)
-    admin_id = sa.Column(sa.Integer, nullable=False)
+    admin_id = sa.Column(TG_ID, nullable=False)
     admin_name = sa.Column(sa.String(128), nullable=False)
     date = sa.Column(sa.Date, nullable=False)
     replies = sa.Column(sa.Integer, default=0)
@@ -65,8 +86,8 @@ class MessagesToDelete(Base):
     __tablename__ = 'messages_to_delete'
 
     id = sa.Column(sa.Integer, primary_key=True)
-    chat_id = sa.Column(sa.Integer, nullable=False)
-    msg_id = sa.Column(sa.Integer, nullable=False)
+    chat_id = sa.Column(TG_ID, nullable=False)
+    msg_id = sa.Column(TG_ID, nullable=False)
     sent_at = sa.Column(sa.DateTime, nullable=False)
     by_bot = sa.Column(sa.Boolean, nullable=False)
 
@@ -79,18 +100,23 @@ class MirroredMessages(Base):
     __tablename__ = 'mirrored_messages'
 
     id = sa.Column(sa.Integer, primary_key=True)
-    admin_chat_id = sa.Column(sa.Integer, nullable=False)
-    admin_msg_id = sa.Column(sa.Integer, nullable=False)
-    user_chat_id = sa.Column(sa.Integer, nullable=False)
-    user_msg_id = sa.Column(sa.Integer, nullable=False)
-    thread_id = sa.Column(sa.Integer, nullable=True)
+    admin_chat_id = sa.Column(TG_ID, nullable=False)
+    admin_msg_id = sa.Column(TG_ID, nullable=False)
+    user_chat_id = sa.Column(TG_ID, nullable=False)
+    user_msg_id = sa.Column(TG_ID, nullable=False)
+    thread_id = sa.Column(TG_ID, nullable=True)
 
     __table_args__ = (
         sa.UniqueConstraint('admin_chat_id', 'admin_msg_id'),
+        sa.Index('idx_mirrors_user', 'user_chat_id', 'user_msg_id'),
+        sa.Index('idx_mirrors_admin_cover',
+                 'admin_chat_id', 'admin_msg_id', 'user_chat_id', 'user_msg_id', 'thread_id'),
+        sa.Index('idx_mirrors_user_thread', 'user_chat_id', 'thread_id'),
+        sa.Index('idx_mirrors_admin_thread', 'admin_chat_id', 'thread_id'),
     )
 
 
-@dataclass
+@dataclass(slots=True)
 class DbTgUser:
     """
     Fake TgUser to return inserted TgUser row without another DB query
@@ -106,46 +132,76 @@ class DbTgUser:
     can_message: bool = False
 
 
-class SqlDb:
+@dataclass(slots=True)
+class CachedTgUser:
     """
-    A database which uses SQL through SQLAlchemy.
+    The TgUser columns handlers read, as returned and cached by SqlTgUser.get
     """
-    def __init__(self, url: str):
-        self.url = url
-        self.tguser = SqlTgUser(url)
-        self.action = SqlAction(url)
-        self.msgtodel = SqlMessageToDelete(url)
-        self.msgmirror = SqlMirroredMessages(url)
-        self.adminstats = SqlAdminStats(url)
+    user_id: int
+    thread_id: int | None = None
+    subject: str | None = None
+    banned: bool = False
+    first_replied: bool = False
+    can_message: bool = False
 
 
-class SqlRepo:
+def _set_sqlite_pragmas(dbapi_conn, conn_record) -> None:
     """
-    Repository for a table
+    WAL lets readers work alongside a writer, and synchronous=NORMAL
+    syncs on checkpoints instead of on every commit
     """
-    def __init__(self, url: str):
-        self.url = url
+    cursor = dbapi_conn.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.execute('PRAGMA mmap_size=268435456')
+    cursor.execute('PRAGMA cache_size=-65536')  # 64 MiB page cache
+    cursor.close()
 
 
-class SqlTgUser(SqlRepo):
+def make_engine(url: str) -> AsyncEngine:
     """
-    Repository for TgUsers table
+    Create an async engine, tuned for the DB dialect
     """
+    if url.startswith('sqlite'):
+        # aiosqlite gets NullPool by default, which opens a connection (and its thread) per query
+        engine = create_async_engine(url, poolclass=AsyncAdaptedQueuePool, pool_size=5, max_overflow=10)
+        sa.event.listen(engine.sync_engine, 'connect', _set_sqlite_pragmas)
+    else:  # network DBs may drop idle pooled connections
+        engine = create_async_engine(
+            url, pool_size=10, max_overflow=40, pool_recycle=300, pool_timeout=60, pool_pre_ping=True,
+        )
+    return engine
+
 
+class SqlDb:
+    """
+    A database which uses SQL through SQLAlchemy.
+    """
     def __init__(self, url: str):
-        super().__init__(url)
-        self._schema_checked = False
+        self.url = url
+        self.engine = make_engine(url)
+        self.tguser = SqlTgUser(self.engine)
+        self.action = SqlAction(self.engine)
+        self.msgtodel = SqlMessageToDelete(self.engine)
+        self.msgmirror = SqlMirroredMessages(self.engine)
+        self.adminstats = SqlAdminStats(self.engine)
+
+    async def init(self) -> None:
+        """
+        Start the background writers, create missing tables,
+        and add the can_message column to older SQLite DBs which haven't run the migrations
+        """
+        self.msgtodel.start()
+        self.adminstats.start()
+        self.action.start()
 
-    async def _ensure_can_message_column(self) -> None:
-        """Make sure older SQLite DBs have the can_message column.
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
 
-        Some existing installs may not have run the migration yet; to avoid
-        crashes on select/update, we lazily add the column on first access.
-        """
-        if self._schema_checked or 'sqlite' not in self.url:
-            return
+            if self.engine.dialect.name != 'sqlite':
+                return
 
-        async with create_async_engine(self.url).begin() as conn:
             result = await conn.execute(sa.text('PRAGMA table_info(tgusers)'))
             columns = {row[1] for row in result.fetchall()}
             if 'can_message' not in columns:
@@ -156,7 +212,89 @@ class SqlTgUser(SqlRepo):
                     )
                 )
 
-        self._schema_checked = True
+    async def dispose(self) -> None:
+        """
+        Flush queued writes and close all pooled connections
+        """
+        await self.msgtodel.close()
+        await self.adminstats.close()
+        await self.action.close()
+        await self.engine.dispose()
+
+
+class SqlRepo:
+    """
+    Repository for a table, sharing the engine (and its connection pool) of SqlDb
+    """
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+
+
+class SqlTgUser(SqlRepo):
+    """
+    Repository for TgUsers table.
+    Rows read by handlers are cached in process: each bot is long-polled by exactly one
+    process (Telegram allows one getUpdates consumer per token), which is also the only
+    writer of its DB, so there's no other process whose writes a shared cache would have to see.
+    """
+    # what handlers read from a user row, in CachedTgUser order; get_full() has the rest
+    columns = (
+        TgUsers.user_id, TgUsers.thread_id, TgUsers.subject,
+        TgUsers.banned, TgUsers.first_replied, TgUsers.can_message,
+    )
+    # hot statements are built once, with bind params filled in on execute
+    _by_user_id = sa.select(*columns).where(TgUsers.user_id == sa.bindparam('user_id'))
+    _by_thread_id = sa.select(*columns).where(TgUsers.thread_id == sa.bindparam('thread_id'))
+    _touch = (
+        sa.update(TgUsers)
+        .where(
+            (TgUsers.user_id == sa.bindparam('uid')) & TgUsers.can_message & ~TgUsers.banned
+            & TgUsers.thread_id.is_not(None) & TgUsers.first_replied
+        )
+        .values(last_user_msg_at=sa.bindparam('when'))
+        .returning(*columns)
+    )
+
+    def __init__(self, engine: AsyncEngine):
+        super().__init__(engine)
+        self._cache: OrderedDict[int, tuple[CachedTgUser, float]] = OrderedDict()  # user_id: (row, expires_at)
+        self._thread_users: dict[int, int] = {}  # thread_id: user_id
+        self._writes = 0  # to not cache a row read before a concurrent write
+        self._inflight: dict[tuple, asyncio.Task] = {}  # concurrent misses share one SELECT
+
+    def _cached(self, user_id: int | None) -> CachedTgUser | None:
+        if user_id not in self._cache:
+            return None
+        row, expires_at = self._cache[user_id]
+        if expires_at < time.monotonic():
+            self._drop(user_id)
+            return None
+        self._cache.move_to_end(user_id)
+        return row
+
+    def _remember(self, row: SaRow) -> CachedTgUser:
+        row = CachedTgUser(*row)
+        self._drop(row.user_id)
+        self._cache[row.user_id] = (row, time.monotonic() + TGUSER_CACHE_TTL)
+        if row.thread_id:
+            self._thread_users[row.thread_id] = row.user_id
+        if len(self._cache) > TGUSER_CACHE_SIZE:
+            self._drop(next(iter(self._cache)))
+        return row
+
+    def _drop(self, user_id: int) -> None:
+        if cached := self._cache.pop(user_id, None):
+            thread_id = cached[0].thread_id
+            if self._thread_users.get(thread_id) == user_id:
+                del self._thread_users[thread_id]
+
+    def _forget(self, user_id: int) -> None:
+        """
+        Invalidate the cached row before changing it in the DB
+        """
+        self._writes += 1
+        self._drop(user_id)
+        self._inflight.clear()
 
     async def add(self,
                   user: agtypes.User,
@@ -164,31 +302,77 @@ class SqlTgUser(SqlRepo):
                   thread_id: int | None = None,
                   first_replied: bool = False,
                   can_message: bool = False) -> DbTgUser:
-        await self._ensure_can_message_column()
         tguser = DbTgUser(
             user_id=user.id, full_name=user.full_name, username=user.username, thread_id=thread_id,
             last_user_msg_at=user_msg.date.replace(tzinfo=None), first_replied=first_replied,
             can_message=can_message,
         )
-        async with create_async_engine(self.url).begin() as conn:
-            await conn.execute(sa.delete(TgUsers).filter_by(user_id=user.id))
-            await conn.execute(sa.insert(TgUsers).values(**asdict(tguser)))
+        vals = asdict(tguser)
+        query = sqlite_insert(TgUsers).values(**vals).on_conflict_do_update(
+            index_elements=['user_id'], set_=vals,
+        )
+        self._forget(user.id)
+        async with self.engine.begin() as conn:
+            await conn.execute(query)
 
         return tguser
 
+    async def upsert(self,
+                     user: agtypes.User,
+                     user_msg: agtypes.Message,
+                     **kwargs) -> None:
+        """
+        Add a TgUser, or if it exists, update only the fields provided as kwargs
+        (first_replied, can_message, etc), in a single statement.
+        """
+        tguser = DbTgUser(
+            user_id=user.id, full_name=user.full_name, username=user.username, thread_id=None,
+            last_user_msg_at=user_msg.date.replace(tzinfo=None), **kwargs,
+        )
+        query = sqlite_insert(TgUsers).values(**asdict(tguser)).on_conflict_do_update(
+            index_elements=['user_id'], set_=kwargs,
+        )
+        self._forget(user.id)
+        async with self.engine.begin() as conn:
+            await conn.execute(query)
+
     async def get(self,
                   user: agtypes.User | None = None,
-                  thread_id: int | None = None) -> SaRow | None:
-        await self._ensure_can_message_column()
+                  thread_id: int | None = None) -> CachedTgUser | None:
         if user:
-            query = sa.select(TgUsers).where(TgUsers.user_id==user.id)
+            if row := self._cached(user.id):
+                return row
+            key, query, params = ('user', user.id), self._by_user_id, {'user_id': user.id}
         else:
-            query = sa.select(TgUsers).where(TgUsers.thread_id==thread_id)
+            if (row := self._cached(self._thread_users.get(thread_id))) and row.thread_id == thread_id:
+                return row
+            key, query, params = ('thread', thread_id), self._by_thread_id, {'thread_id': thread_id}
 
-        async with create_async_engine(self.url).begin() as conn:
-            result = await conn.execute(query)
+        if not (task := self._inflight.get(key)):
+            task = self._inflight[key] = asyncio.ensure_future(self._fetch(query, params))
+
+            def done(_):
+                if self._inflight.get(key) is task:
+                    del self._inflight[key]
+            task.add_done_callback(done)
+        return await asyncio.shield(task)
+
+    async def _fetch(self, query: sa.Select, params: dict) -> CachedTgUser | None:
+        writes = self._writes
+        async with self.engine.connect() as conn:
+            result = await conn.execute(query, params)
             if row := result.fetchone():
-                return row
+                if writes == self._writes:
+                    return self._remember(row)
+                return CachedTgUser(*row)
+
+    async def get_full(self, user_id: int) -> SaRow | None:
+        """
+        The whole user row, with names and dates
+        """
+        async with self.engine.connect() as conn:
+            result = await conn.execute(sa.select(TgUsers).where(TgUsers.user_id==user_id))
+            return result.fetchone()
 
     async def update(self,
                      user_id: int,
@@ -198,28 +382,52 @@ class SqlTgUser(SqlRepo):
         Update TgUser fields (thread_id, subject, etc) provided as kwargs.
         if user_msg provided, set it's date to last_user_msg_at field.
         """
-        await self._ensure_can_message_column()
         if user_msg:
             kwargs['last_user_msg_at'] = user_msg.date.replace(tzinfo=None)
 
-        async with create_async_engine(self.url).begin() as conn:
+        self._forget(user_id)
+        async with self.engine.begin() as conn:
             await conn.execute(sa.update(TgUsers).where(TgUsers.user_id==user_id).values(**kwargs))
 
+    async def touch(self, user_id: int, user_msg: agtypes.Message) -> CachedTgUser | None:
+        """
+        Set last_user_msg_at of an active user with a topic, who has been replied already,
+        and return the updated row in the same statement. None if the user is anything else.
+        """
+        cached = self._cached(user_id)
+        if cached and not (cached.can_message and not cached.banned and cached.thread_id and cached.first_replied):
+            return None  # known not to match, e.g. a banned user: skip the write
+
+        self._forget(user_id)
+        async with self.engine.begin() as conn:
+            result = await conn.execute(
+                self._touch, {'uid': user_id, 'when': user_msg.date.replace(tzinfo=None)},
+            )
+            if row := result.fetchone():
+                return self._remember(row)
+
     async def del_thread_id(self, user_id: int) -> None:
-        await self._ensure_can_message_column()
-        async with create_async_engine(self.url).begin() as conn:
+        self._forget(user_id)
+        async with self.engine.begin() as conn:
             query = sa.update(TgUsers).where(TgUsers.user_id==user_id).values(thread_id=None)
             await conn.execute(query)
 
-    async def get_all(self) -> list[SaRow]:
-        async with create_async_engine(self.url).begin() as conn:
-            result = await conn.execute(sa.select(TgUsers))
-            return result.fetchall()
+    async def get_active_user_ids(self) -> list[int]:
+        """
+        IDs of all the users who are not banned
+        """
+        async with self.engine.connect() as conn:
+            result = await conn.scalars(sa.select(TgUsers.user_id).where(~TgUsers.banned))
+            return result.all()
 
     async def get_olds(self) -> list[SaRow]:
-        async with create_async_engine(self.url).begin() as conn:
-            ago = datetime.datetime.utcnow() - datetime.timedelta(weeks=2)
-            query = sa.select(TgUsers).where(TgUsers.last_user_msg_at <= ago)
+        """
+        (user_id, thread_id) of the users with a topic who wrote last time 2+ weeks ago
+        """
+        async with self.engine.connect() as conn:
+            ago = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) - datetime.timedelta(weeks=2)
+            query = sa.select(TgUsers.user_id, TgUsers.thread_id).where(
+                (TgUsers.last_user_msg_at <= ago) & TgUsers.thread_id.is_not(None))
 
             result = await conn.execute(query)
             return result.fetchall()
@@ -227,29 +435,76 @@ class SqlTgUser(SqlRepo):
 
 class SqlAction(SqlRepo):
     """
-    Repository for ActionStats table
+    Repository for ActionStats table.
+    Actions are counted in memory and added to the db by a background flusher.
     """
-    async def add(self, name: str) -> None:
+    _add = sqlite_insert(ActionStats)
+    _add = _add.on_conflict_do_update(
+        index_elements=['name', 'date'], set_={'count': ActionStats.count + _add.excluded.count},
+    )
+
+    def __init__(self, engine: AsyncEngine):
+        super().__init__(engine)
+        self._counts: Counter[tuple[str, datetime.date]] = Counter()
+        self._flusher: asyncio.Task | None = None
+
+    def bump(self, name: str) -> None:
         """
-        Sum it with the existing action count for today
+        Count one action for today, it'll reach the db on the next flush
         """
-        async with create_async_engine(self.url).begin() as conn:
-            vals = {'name': name, 'date': datetime.date.today(), 'count': 1}
-            insert_q = sa.insert(ActionStats).values(vals)
-            update_q = sa.update(ActionStats).values(count=ActionStats.count + 1).where(
-                (ActionStats.name == vals['name']) & (ActionStats.date == vals['date'])
-            )
+        self._counts[name, datetime.date.today()] += 1
+
+    def start(self) -> None:
+        """
+        Start the background flusher, if it's not running yet
+        """
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_forever())
+
+    async def _flush_forever(self) -> None:
+        while True:
+            await asyncio.sleep(ACTIONS_FLUSH_INTERVAL)
             try:
-                await conn.execute(insert_q)
-            except IntegrityError:
-                await conn.execute(update_q)
+                await self.flush()
+            except Exception:
+                logging.getLogger('support_bot').exception('Failed to save action stats')
+
+    async def flush(self) -> None:
+        """
+        Sum the counted actions with the existing ones, one row per action and day
+        """
+        if not self._counts:
+            return
+
+        counts, self._counts = self._counts, Counter()
+        rows = [{'name': name, 'date': date, 'count': count} for (name, date), count in counts.items()]
+        try:
+            async with self.engine.begin() as conn:
+                await conn.execute(self._add, rows)
+        except BaseException:  # a cancelled flush too
+            self._counts.update(counts)  # retry them on the next flush
+            raise
+
+    async def close(self) -> None:
+        """
+        Stop the flusher and write what's still counted
+        """
+        if self._flusher:
+            self._flusher.cancel()
+            try:  # let a cancelled write put its counts back before the last flush
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
 
     async def get_grouped(self, from_date: datetime.date, to_date: datetime.date | None = None) -> list:
         """
         Statistics over time between from_date and to_date (inclusive)
         """
         to_date = to_date or datetime.date.today()
-        async with create_async_engine(self.url).begin() as conn:
+        await self.flush()
+        async with self.engine.connect() as conn:
             query = (
                 sa.select(ActionStats.name, sa.func.sum(ActionStats.count))
                 .where(ActionStats.date >= from_date)
@@ -263,7 +518,8 @@ class SqlAction(SqlRepo):
         """
         Statistics over entire bot existence time
         """
-        async with create_async_engine(self.url).begin() as conn:
+        await self.flush()
+        async with self.engine.connect() as conn:
             query = (
                 sa.select(ActionStats.name, sa.func.sum(ActionStats.count))
                 .group_by(ActionStats.name)
@@ -274,30 +530,92 @@ class SqlAction(SqlRepo):
 
 class SqlMessageToDelete(SqlRepo):
     """
-    Repository for MessagesToDelete table
+    Repository for MessagesToDelete table.
+    New rows are queued and written in batches by a background flusher.
+
+    The table stays in the main DB file rather than an in-memory one: destruction
+    delays are hours long, so the rows have to survive restarts, and in WAL mode
+    with synchronous=NORMAL a commit doesn't fsync anyway.
     """
+    def __init__(self, engine: AsyncEngine):
+        super().__init__(engine)
+        self._pending: asyncio.Queue | None = None
+        self._flusher: asyncio.Task | None = None
+
     async def add(self, msg: agtypes.Message, chat_id: int | None = None) -> None:
         """
         Remember new message
         """
         if chat_id:  # special case when the message was copied
-            vals = {'chat_id': chat_id, 'sent_at': datetime.datetime.utcnow(), 'by_bot': True}
+            sent_at = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+            vals = {'chat_id': chat_id, 'sent_at': sent_at, 'by_bot': True}
         else:  # the usual full message object
             vals = {'chat_id': msg.chat.id, 'sent_at': msg.date, 'by_bot': msg.from_user.is_bot}
 
         vals['msg_id'] = msg.message_id
 
-        async with create_async_engine(self.url).begin() as conn:
+        self.start()
+        self._pending.put_nowait(vals)
+
+    def start(self) -> None:
+        """
+        Start the background flusher, if it's not running yet
+        """
+        if self._flusher is None:
+            self._pending = asyncio.Queue()
+            self._flusher = asyncio.create_task(self._flush_forever())
+
+    async def _flush_forever(self) -> None:
+        """
+        Write queued rows in one transaction per batch, until None is queued
+        """
+        stop = False
+        while not stop:
+            rows = [await self._pending.get()]
+            await asyncio.sleep(MSGTODEL_FLUSH_DELAY)
+            while len(rows) < MSGTODEL_BATCH_SIZE and not self._pending.empty():
+                rows.append(self._pending.get_nowait())
+
+            if None in rows:
+                stop = True
+                rows = [row for row in rows if row is not None]
+            if not rows:
+                continue
+
             try:
-                await conn.execute(sa.insert(MessagesToDelete).values(vals))
-            except IntegrityError:
-                pass  # such message already in the db
+                await self._insert(rows)
+            except Exception:
+                logging.getLogger('support_bot').exception('Failed to save %s messages to delete', len(rows))
+
+    async def _insert(self, rows: list[dict]) -> None:
+        # some messages may be already in the db
+        query = sqlite_insert(MessagesToDelete).on_conflict_do_nothing(index_elements=['chat_id', 'msg_id'])
+        async with self.engine.begin() as conn:
+            await conn.execute(query, rows)
+
+    async def close(self) -> None:
+        """
+        Write what's still queued and stop the flusher
+        """
+        if self._flusher:
+            self._pending.put_nowait(None)
+            await self._flusher
+            self._flusher = None
+
+    async def remove(self, msgs: list[SaRow]) -> None:
+        """
+        Remove rows with these ids
+        """
+        if ids := [msg.id for msg in msgs]:
+            async with self.engine.begin() as conn:
+                query = sa.delete(MessagesToDelete).filter(MessagesToDelete.id.in_(ids))
+                await conn.execute(query)
 
     async def get_many(self, before: datetime.datetime, by_bot: bool) -> list[SaRow]:
         """
         Statistics over entire bot existence time
         """
-        async with create_async_engine(self.url).begin() as conn:
+        async with self.engine.connect() as conn:
             query = sa.select(MessagesToDelete).where(
                 (MessagesToDelete.sent_at <= before) & (MessagesToDelete.by_bot == by_bot))
             result = await conn.execute(query)
@@ -307,37 +625,28 @@ class SqlMessageToDelete(SqlRepo):
 class SqlMirroredMessages(SqlRepo):
     """Repository for mirrored admin→user messages."""
 
-    def __init__(self, url: str):
-        super().__init__(url)
-        self._table_ready = False
-
-    async def _ensure_table(self) -> None:
-        if self._table_ready:
-            return
-
-        async with create_async_engine(self.url).begin() as conn:
-            await conn.execute(
-                sa.text(
-                    """
-                    CREATE TABLE IF NOT EXISTS mirrored_messages (
-                        id INTEGER PRIMARY KEY,
-                        admin_chat_id INTEGER NOT NULL,
-                        admin_msg_id INTEGER NOT NULL,
-                        user_chat_id INTEGER NOT NULL,
-                        user_msg_id INTEGER NOT NULL,
-                        thread_id INTEGER,
-                        UNIQUE(admin_chat_id, admin_msg_id)
-                    )
-                    """
-                )
-            )
-            await conn.execute(
-                sa.text(
-                    "CREATE INDEX IF NOT EXISTS idx_mirrors_user ON mirrored_messages(user_chat_id, user_msg_id)"
-                )
-            )
-
-        self._table_ready = True
+    _by_admin_msg = (
+        (MirroredMessages.admin_chat_id == sa.bindparam('admin_chat_id'))
+        & (MirroredMessages.admin_msg_id == sa.bindparam('admin_msg_id'))
+    )
+    _get = sa.select(
+        MirroredMessages.admin_chat_id, MirroredMessages.admin_msg_id,
+        MirroredMessages.user_chat_id, MirroredMessages.user_msg_id, MirroredMessages.thread_id,
+    ).where(_by_admin_msg)
+    _delete = sa.delete(MirroredMessages).where(_by_admin_msg)
+    _upsert = sqlite_insert(MirroredMessages)
+    _upsert = _upsert.on_conflict_do_update(
+        index_elements=['admin_chat_id', 'admin_msg_id'],
+        set_={
+            'user_chat_id': _upsert.excluded.user_chat_id,
+            'user_msg_id': _upsert.excluded.user_msg_id,
+            'thread_id': _upsert.excluded.thread_id,
+        },
+    )
+    _get_user_id = sa.select(sa.func.coalesce(
+        sa.select(MirroredMessages.user_chat_id).where(_by_admin_msg).scalar_subquery(),
+        sa.select(TgUsers.user_id).where(TgUsers.thread_id == sa.bindparam('thread_id')).scalar_subquery(),
+    ))
 
     async def add(
         self,
@@ -347,112 +656,169 @@ class SqlMirroredMessages(SqlRepo):
         user_msg_id: int,
         thread_id: int | None,
     ) -> None:
-        await self._ensure_table()
-        async with create_async_engine(self.url).begin() as conn:
-            await conn.execute(
-                sa.text(
-                    """
-                    INSERT OR REPLACE INTO mirrored_messages
-                    (admin_chat_id, admin_msg_id, user_chat_id, user_msg_id, thread_id)
-                    VALUES (:admin_chat_id, :admin_msg_id, :user_chat_id, :user_msg_id, :thread_id)
-                    """
-                ),
-                {
-                    "admin_chat_id": admin_chat_id,
-                    "admin_msg_id": admin_msg_id,
-                    "user_chat_id": user_chat_id,
-                    "user_msg_id": user_msg_id,
-                    "thread_id": thread_id,
-                },
-            )
+        """
+        Remember the user copy of an admin message, replacing the previous copy if any
+        """
+        vals = {
+            'admin_chat_id': admin_chat_id,
+            'admin_msg_id': admin_msg_id,
+            'user_chat_id': user_chat_id,
+            'user_msg_id': user_msg_id,
+            'thread_id': thread_id,
+        }
+        async with self.engine.begin() as conn:
+            await conn.execute(self._upsert, vals)
+
+    async def add_many(self, rows: list[dict]) -> None:
+        """
+        Remember many user copies at once, with multi-row INSERTs in one transaction.
+        Each row is a dict with the same keys as add() arguments.
+        """
+        if not rows:
+            return
 
-    async def get(self, admin_chat_id: int, admin_msg_id: int) -> sa.Row | None:
-        await self._ensure_table()
-        async with create_async_engine(self.url).begin() as conn:
+        # old SQLite builds allow 999 bound variables per statement
+        step = SQLITE_MAX_VARIABLES // len(MirroredMessages.__table__.columns)
+
+        async with self.engine.begin() as conn:
+            for i in range(0, len(rows), step):
+                query = sqlite_insert(MirroredMessages).values(rows[i:i + step])
+                query = query.on_conflict_do_update(
+                    index_elements=['admin_chat_id', 'admin_msg_id'],
+                    set_={col: query.excluded[col] for col in ('user_chat_id', 'user_msg_id', 'thread_id')},
+                )
+                await conn.execute(query)
+
+    async def get(self, admin_chat_id: int, admin_msg_id: int) -> SaRow | None:
+        async with self.engine.connect() as conn:
             result = await conn.execute(
-                sa.text(
-                    "SELECT admin_chat_id, admin_msg_id, user_chat_id, user_msg_id, thread_id "
-                    "FROM mirrored_messages WHERE admin_chat_id = :admin_chat_id AND admin_msg_id = :admin_msg_id"
-                ),
-                {"admin_chat_id": admin_chat_id, "admin_msg_id": admin_msg_id},
+                self._get, {'admin_chat_id': admin_chat_id, 'admin_msg_id': admin_msg_id},
             )
             return result.fetchone()
 
+    async def get_user_id(self, admin_chat_id: int, admin_msg_id: int, thread_id: int | None) -> int | None:
+        """
+        The user an admin message is about: the one it was mirrored to,
+        or else the owner of the topic, in one query
+        """
+        async with self.engine.connect() as conn:
+            return await conn.scalar(
+                self._get_user_id,
+                {'admin_chat_id': admin_chat_id, 'admin_msg_id': admin_msg_id, 'thread_id': thread_id},
+            )
+
     async def delete(self, admin_chat_id: int, admin_msg_id: int) -> None:
-        await self._ensure_table()
-        async with create_async_engine(self.url).begin() as conn:
+        async with self.engine.begin() as conn:
             await conn.execute(
-                sa.text(
-                    "DELETE FROM mirrored_messages WHERE admin_chat_id = :admin_chat_id AND admin_msg_id = :admin_msg_id"
-                ),
-                {"admin_chat_id": admin_chat_id, "admin_msg_id": admin_msg_id},
+                self._delete, {'admin_chat_id': admin_chat_id, 'admin_msg_id': admin_msg_id},
             )
 
-    async def remove(self, msgs: list[SaRow]) -> None:
-        """
-        Remove rows with these ids
-        """
-        if ids := [msg.id for msg in msgs]:
-            async with create_async_engine(self.url).begin() as conn:
-                query = sa.delete(MessagesToDelete).filter(MessagesToDelete.id.in_(ids))
-                await conn.execute(query)
-
 
 class SqlAdminStats(SqlRepo):
-    """Repository for per-admin stats (replies/edits/deletes)."""
-
-    def __init__(self, url: str):
-        super().__init__(url)
-        self._ensured = False
+    """
+    Repository for per-admin stats (replies/edits/deletes).
+    Bumps are summed in memory and written as deltas by a background flusher.
+    """
+    fields = ('replies', 'edits', 'deletes')
 
-    async def _ensure_table(self) -> None:
-        if self._ensured:
-            return
-        async with create_async_engine(self.url).begin() as conn:
-            await conn.run_sync(Base.metadata.create_all)
-        self._ensured = True
+    def __init__(self, engine: AsyncEngine):
+        super().__init__(engine)
+        self._deltas: defaultdict[tuple[int, datetime.date], Counter] = defaultdict(Counter)
+        self._names: dict[int, str] = {}
+        self._flusher: asyncio.Task | None = None
 
-    async def bump(self, admin_id: int, admin_name: str, field: str) -> None:
-        await self._ensure_table()
-        today = datetime.date.today()
+    def bump(self, admin_id: int, admin_name: str, field: str) -> None:
+        """
+        Count one admin action, it'll reach the db on the next flush
+        """
         field = field.lower()
-        if field not in {'replies', 'edits', 'deletes'}:
+        if field not in self.fields:
             return
 
-        async with create_async_engine(self.url).begin() as conn:
-            vals = {
-                'admin_id': admin_id,
-                'admin_name': admin_name or '—',
-                'date': today,
-                field: 1,
-            }
-            insert_q = sa.insert(AdminStats).values(vals)
-            update_q = (
-                sa.update(AdminStats)
-                .where((AdminStats.admin_id == vals['admin_id']) & (AdminStats.date == vals['date']))
-                .values(**{field: getattr(AdminStats, field) + 1, 'admin_name': vals['admin_name']})
-            )
+        self._deltas[admin_id, datetime.date.today()][field] += 1
+        self._names[admin_id] = admin_name or '—'
+
+    def start(self) -> None:
+        """
+        Start the background flusher, if it's not running yet
+        """
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_forever())
+
+    async def _flush_forever(self) -> None:
+        while True:
+            await asyncio.sleep(ADMINSTATS_FLUSH_INTERVAL)
             try:
-                await conn.execute(insert_q)
-            except IntegrityError:
-                await conn.execute(update_q)
+                await self.flush()
+            except Exception:
+                logging.getLogger('support_bot').exception('Failed to save admin stats')
 
-    async def get_range(self, from_date: datetime.date, to_date: datetime.date | None = None) -> list[SaRow]:
-        await self._ensure_table()
+    async def flush(self) -> None:
+        """
+        Add the counted deltas to the db, one row per admin and day
+        """
+        if not self._deltas:
+            return
+
+        deltas, self._deltas = self._deltas, defaultdict(Counter)
+        rows = [
+            {'admin_id': admin_id, 'admin_name': self._names[admin_id], 'date': date}
+            | {field: counts[field] for field in self.fields}
+            for (admin_id, date), counts in deltas.items()
+        ]
+        query = sqlite_insert(AdminStats)
+        query = query.on_conflict_do_update(
+            index_elements=['admin_id', 'date'],
+            set_={field: getattr(AdminStats, field) + getattr(query.excluded, field) for field in self.fields}
+            | {'admin_name': query.excluded.admin_name},
+        )
+        try:
+            async with self.engine.begin() as conn:
+                await conn.execute(query, rows)
+        except BaseException:  # a cancelled flush too
+            # put the deltas back to retry them on the next flush
+            for key, counts in deltas.items():
+                self._deltas[key].update(counts)
+            raise
+
+    async def close(self) -> None:
+        """
+        Stop the flusher and write what's still counted
+        """
+        if self._flusher:
+            self._flusher.cancel()
+            try:  # let a cancelled write put its counts back before the last flush
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+
+    async def get_range_with_totals(
+            self, from_date: datetime.date, to_date: datetime.date | None = None,
+    ) -> tuple[list[SaRow], tuple[int, int, int]]:
+        """
+        Per-admin sums between from_date and to_date (inclusive), most replies first,
+        and the totals over all admins, summed by the db with a window over the same query
+        """
         to_date = to_date or datetime.date.today()
-        async with create_async_engine(self.url).begin() as conn:
+        await self.flush()
+        async with self.engine.connect() as conn:
+            sums = [sa.func.sum(getattr(AdminStats, field)) for field in self.fields]
             query = (
                 sa.select(
                     AdminStats.admin_id,
                     AdminStats.admin_name,
-                    sa.func.sum(AdminStats.replies),
-                    sa.func.sum(AdminStats.edits),
-                    sa.func.sum(AdminStats.deletes),
+                    *sums,
+                    *(sa.func.sum(col).over() for col in sums),
                 )
                 .where(AdminStats.date >= from_date)
                 .where(AdminStats.date <= to_date)
                 .group_by(AdminStats.admin_id, AdminStats.admin_name)
-                .order_by(sa.desc(sa.func.sum(AdminStats.replies)))
+                .order_by(sa.desc(sums[0]))
             )
             result = await conn.execute(query)
-            return result.fetchall()
+            rows = result.fetchall()
+
+        totals = tuple(rows[0][5:]) if rows else (0, 0, 0)
+        return [row[:5] for row in rows], totals
@@ -41,7 +41,7 @@ class ReplyToBotInGroupForwardedFilter(Filter):
             by_bot = to_msg.from_user.id == msg.bot.id
             not_topic_reply = to_msg.message_id != msg.message_thread_id
 
-            group_id = int(msg.bot.cfg['admin_group_id'])
+            group_id = msg.bot.admin_group_id
             is_admin_group_1 = msg.chat.id == group_id
             is_admin_group_2 = to_msg.chat.id == group_id
 
@@ -54,7 +54,7 @@ class InAdminGroup(Filter):
     in General topic (message_thread_id is None)
     """
     async def __call__(self, msg: agtypes.Message) -> bool:
-        is_admin_group = msg.chat.id == int(msg.bot.cfg['admin_group_id'])
+        is_admin_group = msg.chat.id == msg.bot.admin_group_id
         return is_admin_group and not msg.message_thread_id
 
 
@@ -64,7 +64,7 @@ class InAdminTopic(Filter):
     """
 
     async def __call__(self, msg: agtypes.Message) -> bool:
-        is_admin_group = msg.chat.id == int(msg.bot.cfg['admin_group_id'])
+        is_admin_group = msg.chat.id == msg.bot.admin_group_id
         return is_admin_group and bool(msg.message_thread_id)
 
 
@@ -83,7 +83,7 @@ class BtnInAdminGroup(Filter):
     """
     async def __call__(self, call: agtypes.CallbackQuery) -> bool:
         msg = call.message
-        return msg.chat.id == int(msg.bot.cfg['admin_group_id'])
+        return msg.chat.id == msg.bot.admin_group_id
 
 
 class BtnInAdminTopic(Filter):
@@ -93,7 +93,7 @@ class BtnInAdminTopic(Filter):
 
     async def __call__(self, call: agtypes.CallbackQuery) -> bool:
         msg = call.message
-        return msg.chat.id == int(msg.bot.cfg['admin_group_id']) and bool(msg.message_thread_id)
+        return msg.chat.id == msg.bot.admin_group_id and bool(msg.message_thread_id)
 
 
 class BtnInPrivateChat(Filter):
@@ -1,13 +1,13 @@
 """
 Work with Google Sheets
 """
+import asyncio
 import string
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Any
 
 import aiogram.types as agtypes
 import gspread_asyncio
-from gspread_asyncio import AsyncioGspreadWorksheet
 from gspread.exceptions import SpreadsheetNotFound, WorksheetNotFound
 from gspread.utils import ValueInputOption
 
@@ -19,6 +19,8 @@ CLIENT = None
 CLIENT_MANAGER = None
 COLUMN_NAMES = 'When, UTC', 'Type', 'Who', 'To whom', 'Text', 'Filename', 'Forward', 'Subject'
 LAST_COLUMN_SHEET_LETTER = string.ascii_uppercase[len(COLUMN_NAMES) - 1]
+BATCH_SIZE = 100
+FLUSH_DELAY = 1.0  # seconds to gather a batch
 
 
 async def _get_client(bot):
@@ -78,7 +80,7 @@ async def _ensure_worksheet(doc):
     """
     Get or reate a worksheet with correct columns
     """
-    now = datetime.utcnow()
+    now = datetime.now(timezone.utc)
     name = f'{now.year}-{now.month}'
     try:
         sheet = await doc.worksheet(name)
@@ -97,62 +99,113 @@ async def _ensure_worksheet(doc):
     return sheet
 
 
-async def _gsheets_connect(msg: agtypes.Message) -> None:
-    """
-    Prepare everything to insert a row:
-    autheticate, ensure spreadsheet, ensure worksheet,
-    calculate a place to insert, construct row fields
-    """
-    bot = msg.bot
-    client = await _get_client(bot)
-
-    gsheets_filename = bot.cfg['save_messages_gsheets_filename']
-    await bot.log(f'Saving message to Google Sheet "{gsheets_filename}"')
-
-    try:  # open spreadsheet document
-        doc = await client.open(gsheets_filename)
-    except SpreadsheetNotFound as exc:
-        await bot.log_error(exc)
-        return
-
-    sheet = await _ensure_worksheet(doc)
-    row_data = _msg_to_row_data(msg)
-    index = len(await sheet.col_values(1)) + 1
-    return sheet, row_data, index
-
-
-async def _insert_row(sheet: AsyncioGspreadWorksheet, rd: dict, index: int) -> None:
-    """
-    Insert row field in right order into provided worksheet
-    """
-    row = (rd['when'], rd['type'], rd['who'], rd['to_whom'], rd['text'], rd['filename'],
-           rd['forward'], rd['subject'])
-    await sheet.insert_row(row, index=index, value_input_option=ValueInputOption.user_entered)
+def _to_row(rd: dict) -> tuple:
+    """
+    Row fields in the order of COLUMN_NAMES
+    """
+    return (rd['when'], rd['type'], rd['who'], rd['to_whom'], rd['text'], rd['filename'],
+            rd['forward'], rd['subject'])
+
+
+class GSheetsWriter:
+    """
+    Queues message rows of a bot and inserts them into its spreadsheet in batches,
+    by a background task, so handlers don't wait for Google and stay under its write quota
+    """
+    def __init__(self, bot):
+        self._bot = bot
+        self._pending: asyncio.Queue | None = None
+        self._flusher: asyncio.Task | None = None
+
+    def submit(self, row: tuple, highlight: bool = False) -> None:
+        """
+        Queue a row to be saved
+        """
+        if self._flusher is None:
+            self._pending = asyncio.Queue()
+            self._flusher = asyncio.create_task(self._flush_forever())
+        self._pending.put_nowait((row, highlight))
+
+    async def _flush_forever(self) -> None:
+        """
+        Write queued rows with a few requests per batch, until None is queued
+        """
+        stop = False
+        while not stop:
+            batch = [await self._pending.get()]
+            await asyncio.sleep(FLUSH_DELAY)
+            while len(batch) < BATCH_SIZE and not self._pending.empty():
+                batch.append(self._pending.get_nowait())
+
+            if None in batch:
+                stop = True
+                batch = [item for item in batch if item is not None]
+            if not batch:
+                continue
+
+            try:
+                await self._insert(batch)
+            except Exception as exc:
+                await self._bot.log_error(exc)
+
+    async def _insert(self, batch: list[tuple[tuple, bool]]) -> None:
+        """
+        Authenticate, ensure the spreadsheet and worksheet, insert the rows after the last one
+        """
+        bot = self._bot
+        client = await _get_client(bot)
+
+        gsheets_filename = bot.cfg['save_messages_gsheets_filename']
+        await bot.log(f'Saving {len(batch)} messages to Google Sheet "{gsheets_filename}"')
+
+        try:  # open spreadsheet document
+            doc = await client.open(gsheets_filename)
+        except SpreadsheetNotFound as exc:
+            await bot.log_error(exc)
+            return
+
+        sheet = await _ensure_worksheet(doc)
+        index = len(await sheet.col_values(1)) + 1
+        await sheet.insert_rows(
+            [row for row, _ in batch], row=index, value_input_option=ValueInputOption.user_entered,
+        )
+
+        bold = [{'range': f'A{index + i}:D{index + i}', 'format': {'textFormat': {'bold': True}}}
+                for i, (_, highlight) in enumerate(batch) if highlight]
+        if bold:
+            await sheet.batch_format(bold)
+
+    async def close(self) -> None:
+        """
+        Write what's still queued and stop the flusher
+        """
+        if self._flusher:
+            self._pending.put_nowait(None)
+            await self._flusher
+            self._flusher = None
 
 
 async def gsheets_save_admin_message(msg: agtypes.Message, tguser) -> None:
     """
     Save a message written by Admin in Google Sheets
     """
-    sheet, row_data, index = await _gsheets_connect(msg)
+    row_data = _msg_to_row_data(msg)
+    tguser = await msg.bot.db.tguser.get_full(tguser.user_id)
     row_data['to_whom'] = _to_gsheet_text(make_short_user_info(tguser=tguser))
-    await _insert_row(sheet, row_data, index)
+    msg.bot.gsheets.submit(_to_row(row_data))
 
 
 async def gsheets_save_user_message(msg: agtypes.Message, highlight: bool=False) -> None:
     """
     Save a message written by User in Google Sheets
     """
-    sheet, row_data, index = await _gsheets_connect(msg)
+    row_data = _msg_to_row_data(msg)
 
     botname = msg.bot.name.lower()
     to_whom = botname if botname.endswith('bot') else f'{botname} bot'
     row_data['to_whom'] = _to_gsheet_text(to_whom)
     row_data['subject'] = (await msg.bot.db.tguser.get(user=msg.from_user)).subject
-    await _insert_row(sheet, row_data, index)
-
-    if highlight:
-        await format_cells(sheet, f"A{index}:D{index}", ('bold',))
+    msg.bot.gsheets.submit(_to_row(row_data), highlight=highlight)
 
 
 async def format_cells(sheet, ranje: str, modes: tuple[str], switch: bool=True):
@@ -1,18 +1,20 @@
+import asyncio
 import datetime
+import re
 
 import aiogram.types as agtypes
 from aiogram import Dispatcher
 from aiogram.exceptions import TelegramBadRequest
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 
 from . import buttons
 from .admin_actions import BroadcastForm, admin_broadcast_ask_confirm, admin_broadcast_finish
 from .buttons import admin_btn_handler, send_new_msg_with_keyboard, user_btn_handler
 from .callback_data import CBD
 from .informing import (
+    LogHandlers,
     build_stats_report,
     handle_error,
-    log,
     save_admin_message,
     save_user_message,
 )
@@ -24,18 +26,31 @@ from .filters import (
 from .topics import create_user_topic
 from .utils import save_for_destruction
 
+# Telegram errors which mean the user topic is gone and has to be created again
+_THREAD_GONE = re.compile('thread not found|topic_deleted', re.IGNORECASE)
+ALBUM_COLLECT_DELAY = 0.3  # seconds to wait for the rest of an album, which comes as separate updates
+
+# stats command → (days back or 'month', report title)
+STATS_PERIODS = {
+    'stats': (6, 'Статистика за неделю'),
+    'stats_week': (6, 'Статистика за неделю'),
+    'stats_today': (0, 'Статистика за сегодня'),
+    'stats_month': ('month', 'Статистика за месяц'),
+}
+
 
-@log
-@handle_error
 async def cmd_start(msg: agtypes.Message, *args, **kwargs) -> None:
     """
     Reply to /start
     """
     bot, user, db = msg.bot, msg.chat, msg.bot.db
-    sentmsg = await send_new_msg_with_keyboard(bot, user.id, bot.cfg['hello_msg'], bot.menu)
+    sentmsg, tguser = await asyncio.gather(
+        send_new_msg_with_keyboard(bot, user.id, bot.cfg['hello_msg'], bot.menu),
+        db.tguser.get(user=user),
+    )
 
     new_user = False
-    if not await db.tguser.get(user=user):  # save user if it's new
+    if not tguser:  # save user if it's new
         await db.tguser.add(user, msg)
         new_user = True
 
@@ -56,8 +71,6 @@ async def _group_hello(msg: agtypes.Message):
     await msg.bot.send_message(group.id, text)
 
 
-@log
-@handle_error
 async def added_to_group(msg: agtypes.Message, *args, **kwargs):
     """
     Report group ID when added to a group
@@ -68,8 +81,6 @@ async def added_to_group(msg: agtypes.Message, *args, **kwargs):
             break
 
 
-@log
-@handle_error
 async def group_chat_created(msg: agtypes.Message, *args, **kwargs):
     """
     Report group ID when a group with the bot is created
@@ -77,29 +88,66 @@ async def group_chat_created(msg: agtypes.Message, *args, **kwargs):
     await _group_hello(msg)
 
 
-@log
-@handle_error
+async def _forward_to_topic(msg: agtypes.Message, tguser, thread_id: int) -> int:
+    """
+    Forward a user message to the user topic, recreating the topic if it vanished.
+    Return the thread id the message ended up in.
+    """
+    try:
+        await msg.forward(msg.bot.admin_group_id, message_thread_id=thread_id)
+    except TelegramBadRequest as exc:  # the topic vanished for whatever reason
+        if _THREAD_GONE.search(exc.message):
+            thread_id = await _forward_to_new_topic(msg, tguser)
+    return thread_id
+
+
+async def _forward_to_new_topic(msg: agtypes.Message, tguser=None) -> int:
+    """
+    Create a topic for the user and forward a user message there, return its thread id
+    """
+    thread_id = await create_user_topic(msg, tguser=tguser)
+    await msg.forward(msg.bot.admin_group_id, message_thread_id=thread_id)
+    return thread_id
+
+
+async def _send_first_reply(msg: agtypes.Message) -> None:
+    """
+    Send the configured auto-reply to the first user message
+    """
+    bot = msg.bot
+    if text := bot.first_reply:
+        sentmsg = await bot.send_message(msg.chat.id, text)
+        await save_for_destruction(sentmsg, bot)
+
+
 async def user_message(msg: agtypes.Message, *args, **kwargs) -> None:
     """
     Create topic and a user row in db if needed,
     then forward user message to internal admin group
     """
-    group_id = msg.bot.cfg['admin_group_id']
+    group_id = msg.bot.admin_group_id
     bot, user, db = msg.bot, msg.chat, msg.bot.db
 
-    tguser = await db.tguser.get(user=user)
+    if tguser := await db.tguser.touch(user.id, msg):  # the usual case: a known user with a topic
+        thread_id = await _forward_to_topic(msg, tguser, tguser.thread_id)
+        if thread_id != tguser.thread_id:
+            await db.tguser.update(user.id, thread_id=thread_id)
 
-    if tguser and getattr(tguser, 'banned', False):
-        await save_user_message(msg, new_user=False, stat=False)
+        await save_user_message(msg)
         await save_for_destruction(msg, bot)
         return
 
-    can_message = bool(tguser and getattr(tguser, 'can_message', False))
+    tguser = await db.tguser.get(user=user)
+
+    if tguser and tguser.banned:  # costs nothing but a cache hit, neither db writes nor sheets
+        return
+
+    can_message = bool(tguser and tguser.can_message)
 
     if not can_message:
         new_user = not bool(tguser)
         # User must tap "contact" first — show the hint and keep the menu visible
-        gate_msg = bot.cfg.get('contact_gate_msg')
+        gate_msg = bot.contact_gate_msg
         sentmsg = await send_new_msg_with_keyboard(bot, user.id, gate_msg, bot.menu)
 
         if not tguser:
@@ -111,39 +159,45 @@ async def user_message(msg: agtypes.Message, *args, **kwargs) -> None:
         return
 
     if tguser:
-        if thread_id := tguser.thread_id:
-            try:
-                await msg.forward(group_id, message_thread_id=thread_id)
-            except TelegramBadRequest as exc:  # the topic vanished for whatever reason
-                if 'thread not found' in exc.message.lower():
-                    thread_id = await create_user_topic(msg, tguser=tguser)
-                    await msg.forward(group_id, message_thread_id=thread_id)
+        if tguser.thread_id:
+            forwarding = _forward_to_topic(msg, tguser, tguser.thread_id)
         else:
-            thread_id = await create_user_topic(msg, tguser=tguser)
-            await msg.forward(group_id, message_thread_id=thread_id)
+            forwarding = _forward_to_new_topic(msg, tguser)
 
         if tguser.first_replied:
+            thread_id = await forwarding
             await db.tguser.update(user.id, user_msg=msg, thread_id=thread_id)
-        else:
-            if bot.cfg['first_reply']:
-                sentmsg = await bot.send_message(user.id, bot.cfg['first_reply'])
-                await save_for_destruction(sentmsg, bot)
+        else:  # the reply goes to the user chat, so it doesn't wait for the forward
+            thread_id, _ = await asyncio.gather(forwarding, _send_first_reply(msg))
             await db.tguser.update(user.id, user_msg=msg, thread_id=thread_id, first_replied=True)
 
     else:
         thread_id = await create_user_topic(msg)
-        if bot.cfg['first_reply']:
-            sentmsg = await bot.send_message(user.id, bot.cfg['first_reply'])
-            await save_for_destruction(sentmsg, bot)
-        tguser = await db.tguser.add(user, msg, thread_id, first_replied=True, can_message=True)
-        await msg.forward(group_id, message_thread_id=thread_id)
+        tguser, _, _ = await asyncio.gather(
+            db.tguser.add(user, msg, thread_id, first_replied=True, can_message=True),
+            msg.forward(group_id, message_thread_id=thread_id),
+            _send_first_reply(msg),
+        )
 
     await save_user_message(msg)
     await save_for_destruction(msg, bot)
 
 
-@log
-@handle_error
+async def _save_admin_reply(msg: agtypes.Message, tguser, copied: agtypes.MessageId) -> None:
+    """
+    Remember the user copy of an admin message and count the reply
+    """
+    db = msg.bot.db
+    await db.msgmirror.add(
+        admin_chat_id=msg.chat.id,
+        admin_msg_id=msg.message_id,
+        user_chat_id=tguser.user_id,
+        user_msg_id=copied.message_id,
+        thread_id=msg.message_thread_id,
+    )
+    db.adminstats.bump(msg.from_user.id, msg.from_user.full_name or msg.from_user.username, 'replies')
+
+
 async def admin_message(msg: agtypes.Message, *args, **kwargs) -> None:
     """
     Forward an admin's message from a topic to the linked user without requiring a reply.
@@ -158,23 +212,59 @@ async def admin_message(msg: agtypes.Message, *args, **kwargs) -> None:
         # Игнорируем без уведомлений, чтобы не шуметь операторам.
         return
 
-    copied = await msg.copy_to(tguser.user_id)
-    await db.adminstats.bump(msg.from_user.id, msg.from_user.full_name or msg.from_user.username, 'replies')
-    await db.msgmirror.add(
-        admin_chat_id=msg.chat.id,
-        admin_msg_id=msg.message_id,
-        user_chat_id=tguser.user_id,
-        user_msg_id=copied.message_id,
-        thread_id=msg.message_thread_id,
-    )
+    if msg.media_group_id:
+        return await _admin_album(msg, tguser)
 
-    await save_admin_message(msg, tguser)
+    copied = await msg.copy_to(tguser.user_id)
     await save_for_destruction(copied, bot, chat_id=tguser.user_id)
 
+    # the DB write overlaps with Google Sheets
+    await asyncio.gather(_save_admin_reply(msg, tguser, copied), save_admin_message(msg, tguser))
+
+
+async def _admin_album(msg: agtypes.Message, tguser) -> None:
+    """
+    Copy an admin album to the user with one copyMessages request.
+    The first message of the album waits for the rest and sends them all.
+    Parts coming later than ALBUM_COLLECT_DELAY go with another request,
+    so the user gets such an album split in two.
+    """
+    bot, db = msg.bot, msg.bot.db
+    albums = bot._pending_albums
+    if album := albums.get(msg.media_group_id):
+        album.append(msg)
+        return
+
+    album = albums[msg.media_group_id] = [msg]
+    await asyncio.sleep(ALBUM_COLLECT_DELAY)
+    del albums[msg.media_group_id]
+
+    album.sort(key=lambda m: m.message_id)  # copyMessages wants the ids in order
+    copies = await bot.copy_messages(tguser.user_id, msg.chat.id, [m.message_id for m in album])
+
+    for copied in copies:
+        await save_for_destruction(copied, bot, chat_id=tguser.user_id)
+    for admin_msg in album:
+        db.adminstats.bump(
+            admin_msg.from_user.id, admin_msg.from_user.full_name or admin_msg.from_user.username, 'replies',
+        )
+
+    # copyMessages skips what it can't copy, and then the copies can't be matched to the originals
+    rows = []
+    if len(copies) == len(album):
+        rows = [{
+            'admin_chat_id': admin_msg.chat.id,
+            'admin_msg_id': admin_msg.message_id,
+            'user_chat_id': tguser.user_id,
+            'user_msg_id': copied.message_id,
+            'thread_id': admin_msg.message_thread_id,
+        } for admin_msg, copied in zip(album, copies)]
+    else:
+        await bot.log(f'Copied {len(copies)} of {len(album)} album messages, not mirroring them')
+
+    await asyncio.gather(db.msgmirror.add_many(rows), *[save_admin_message(m, tguser) for m in album])
 
 
-@log
-@handle_error
 async def mention_in_admin_group(msg: agtypes.Message, *args, **kwargs):
     """
     Report group ID when a group with the bot is created
@@ -184,15 +274,13 @@ async def mention_in_admin_group(msg: agtypes.Message, *args, **kwargs):
     await send_new_msg_with_keyboard(bot, group.id, 'Choose:', bot.admin_menu)
 
 
-@log
-@handle_error
 async def admin_quick_reply_handler(call: agtypes.CallbackQuery, *args, **kwargs):
     """
     Handle quick-reply buttons inside admin topics
     """
     msg = call.message
     bot = msg.bot
-    cbd = buttons.CBD.unpack(call.data)
+    cbd = buttons.CBD.from_call(call)
 
     if not bot.admin_quick_replies:
         return await call.answer('Нет быстрых ответов в admin_replies.toml', show_alert=True)
@@ -201,7 +289,7 @@ async def admin_quick_reply_handler(call: agtypes.CallbackQuery, *args, **kwargs
     if not tguser:
         return await call.answer('Не удалось найти пользователя для этой темы', show_alert=True)
 
-    menuitem, _ = buttons._find_menu_item(bot.admin_quick_replies, cbd)
+    menuitem, _ = buttons._find_menu_item(bot._quick_reply_index, cbd)
     btn = buttons._create_button(menuitem) if menuitem else None
     if not btn:
         return await call.answer('Ответ не найден', show_alert=True)
@@ -263,8 +351,6 @@ async def _mirror_update_from_admin(bot, admin_msg: agtypes.Message, mapping) ->
     return False
 
 
-@log
-@handle_error
 async def admin_message_edit(msg: agtypes.Message, *args, **kwargs) -> None:
     """Mirror edits from admin topics to the user's chat."""
 
@@ -274,11 +360,9 @@ async def admin_message_edit(msg: agtypes.Message, *args, **kwargs) -> None:
         return
 
     if await _mirror_update_from_admin(bot, msg, mapping):
-        await db.adminstats.bump(msg.from_user.id, msg.from_user.full_name or msg.from_user.username, 'edits')
+        db.adminstats.bump(msg.from_user.id, msg.from_user.full_name or msg.from_user.username, 'edits')
 
 
-@log
-@handle_error
 async def admin_sync_message(msg: agtypes.Message, *args, **kwargs) -> None:
     """Force-sync a reply to the user if автозеркало не сработало (команда).
 
@@ -302,8 +386,16 @@ async def admin_sync_message(msg: agtypes.Message, *args, **kwargs) -> None:
         await msg.answer('⚠️ Не удалось обновить сообщение у пользователя')
 
 
-@log
-@handle_error
+async def _delete_quietly(bot, chat_id: int, *msg_ids: int) -> None:
+    """
+    Delete messages of a chat in one request, ignoring the ones which are gone already
+    """
+    try:
+        await bot.delete_messages(chat_id, list(msg_ids))
+    except TelegramBadRequest:
+        pass
+
+
 async def admin_delete_message(msg: agtypes.Message, *args, **kwargs) -> None:
     """Delete admin message and its mirrored copy at the user side.
 
@@ -318,45 +410,28 @@ async def admin_delete_message(msg: agtypes.Message, *args, **kwargs) -> None:
     if not mapping:
         return await msg.answer('Не нашёл, что удалить у пользователя для этого сообщения')
 
-    try:
-        await bot.delete_message(mapping.user_chat_id, mapping.user_msg_id)
-    except TelegramBadRequest:
-        pass
-
-    try:
-        await bot.delete_message(msg.chat.id, msg.reply_to_message.message_id)
-    except TelegramBadRequest:
-        pass
-
-    await db.msgmirror.delete(msg.chat.id, msg.reply_to_message.message_id)
-    await db.adminstats.bump(msg.from_user.id, msg.from_user.full_name or msg.from_user.username, 'deletes')
-
-    # Clean up the /del command itself
-    try:
-        await bot.delete_message(msg.chat.id, msg.message_id)
-    except TelegramBadRequest:
-        pass
+    db.adminstats.bump(msg.from_user.id, msg.from_user.full_name or msg.from_user.username, 'deletes')
+    await asyncio.gather(
+        _delete_quietly(bot, mapping.user_chat_id, mapping.user_msg_id),
+        # the admin message along with the /del command itself
+        _delete_quietly(bot, msg.chat.id, msg.reply_to_message.message_id, msg.message_id),
+        db.msgmirror.delete(msg.chat.id, msg.reply_to_message.message_id),
+    )
 
 
-@log
-@handle_error
-async def admin_stats_command(msg: agtypes.Message, *args, **kwargs) -> None:
+async def admin_stats_command(msg: agtypes.Message, command: CommandObject, *args, **kwargs) -> None:
     """Показать статистику за период (день или неделя) в стат-туре."""
 
     bot = msg.bot
-    text = msg.text or ''
-    if 'today' in text:
-        from_date = datetime.date.today()
-        title = 'Статистика за сегодня'
-    elif 'month' in text:
-        from_date = datetime.date.today().replace(day=1)
-        title = 'Статистика за месяц'
+    period, title = STATS_PERIODS.get(command.command, STATS_PERIODS['stats'])
+    today = datetime.date.today()
+    if period == 'month':
+        from_date = today.replace(day=1)
     else:
-        from_date = datetime.date.today() - datetime.timedelta(days=6)
-        title = 'Статистика за неделю'
+        from_date = today - datetime.timedelta(days=period)
 
-    stats_thread = bot.cfg.get('stats_topic_id')
-    if msg.message_thread_id and stats_thread and int(stats_thread) == msg.message_thread_id:
+    stats_thread = bot.stats_topic_id
+    if msg.message_thread_id and stats_thread == msg.message_thread_id:
         thread_id = msg.message_thread_id
     else:
         thread_id = None
@@ -364,54 +439,40 @@ async def admin_stats_command(msg: agtypes.Message, *args, **kwargs) -> None:
     await bot.send_to_stats_topic(report, message_thread_id=thread_id)
 
 
-@log
-@handle_error
 async def admin_ban_user(msg: agtypes.Message, *args, **kwargs) -> None:
     """Заблокировать пользователя в текущем топике (ответом на его сообщение)."""
 
     if not msg.reply_to_message:
         return await msg.answer('Ответьте на сообщение пользователя, которого нужно заблокировать')
 
-    bot = msg.bot
-    user_chat_id = None
-    mapping = await bot.db.msgmirror.get(msg.chat.id, msg.reply_to_message.message_id)
-    if mapping:
-        user_chat_id = mapping.user_chat_id
-    elif msg.message_thread_id:
-        tguser = await bot.db.tguser.get(thread_id=msg.message_thread_id)
-        if tguser:
-            user_chat_id = tguser.user_id
+    db = msg.bot.db
+    user_chat_id = await db.msgmirror.get_user_id(
+        msg.chat.id, msg.reply_to_message.message_id, msg.message_thread_id,
+    )
     if not user_chat_id:
         return await msg.answer('Не нашёл пользователя для этого сообщения')
 
-    await bot.db.tguser.update(user_chat_id, banned=True)
+    await db.tguser.update(user_chat_id, banned=True)
     await msg.answer('🚫 Пользователь заблокирован, новые сообщения игнорируются')
 
 
-@log
-@handle_error
 async def admin_unban_user(msg: agtypes.Message, *args, **kwargs) -> None:
     """Разблокировать пользователя в текущем топике (ответом на его сообщение)."""
 
     if not msg.reply_to_message:
         return await msg.answer('Ответьте на сообщение пользователя, которого нужно разблокировать')
 
-    bot = msg.bot
-    user_chat_id = None
-    mapping = await bot.db.msgmirror.get(msg.chat.id, msg.reply_to_message.message_id)
-    if mapping:
-        user_chat_id = mapping.user_chat_id
-    elif msg.message_thread_id:
-        tguser = await bot.db.tguser.get(thread_id=msg.message_thread_id)
-        if tguser:
-            user_chat_id = tguser.user_id
+    db = msg.bot.db
+    user_chat_id = await db.msgmirror.get_user_id(
+        msg.chat.id, msg.reply_to_message.message_id, msg.message_thread_id,
+    )
     if not user_chat_id:
         return await msg.answer('Не нашёл пользователя для этого сообщения')
 
-    await bot.db.tguser.update(user_chat_id, banned=False)
+    await db.tguser.update(user_chat_id, banned=False)
     await msg.answer('✅ Пользователь разблокирован, сообщения снова будут приниматься')
-@log
-@handle_error
+
+
 async def show_quick_replies(msg: agtypes.Message, *args, **kwargs):
     """
     Show quick replies in the current admin topic
@@ -421,164 +482,54 @@ async def show_quick_replies(msg: agtypes.Message, *args, **kwargs):
     if not bot.admin_quick_replies:
         return await msg.answer('⚠️ Быстрые ответы не настроены (admin_replies.toml)')
 
-    text = '⚡ Быстрые ответы для оператора'
-    await send_new_msg_with_keyboard(
-        bot,
-        msg.chat.id,
-        text,
-        bot.admin_quick_replies,
-        message_thread_id=msg.message_thread_id,
-    )
-
-
-def register_handlers(dp: Dispatcher) -> None:
-    """
-    Register all the handlers to the provided dispatcher
-    """
-    # Commands first so /start не перехватывается как обычное сообщение
-    dp.message.register(cmd_start, PrivateChatFilter(), Command('start'))
-    dp.message.register(show_quick_replies, InAdminTopic(), Command('quick'))
-
-    # Пользователи теперь могут писать со слешами — это не мешает операторам
-    dp.message.register(user_message, PrivateChatFilter())
-
-    dp.message.register(admin_message, InAdminTopic(), ~ACommandFilter())
-    dp.edited_message.register(admin_message_edit, InAdminTopic())
-    dp.message.register(admin_delete_message, InAdminTopic(), Command('del', 'delete'))
-    dp.message.register(show_quick_replies, InAdminTopic(), Command('quick'))
+    await bot.send_quick_replies(msg.message_thread_id)
 
-    # Пользователи теперь могут писать со слешами — это не мешает операторам
-    dp.message.register(user_message, PrivateChatFilter())
-
-    dp.message.register(admin_message, InAdminTopic(), ~ACommandFilter())
-    dp.edited_message.register(admin_message_edit, InAdminTopic())
-    dp.message.register(admin_delete_message, InAdminTopic(), Command('del', 'delete'))
-    dp.message.register(show_quick_replies, InAdminTopic(), Command('quick'))
-
-    # Пользователи теперь могут писать со слешами — это не мешает операторам
-    dp.message.register(user_message, PrivateChatFilter())
-
-    dp.message.register(admin_message, InAdminTopic(), ~ACommandFilter())
-    dp.edited_message.register(admin_message_edit, InAdminTopic())
-    dp.message.register(admin_sync_message, InAdminTopic(), Command('sync', 'resend'))
-    dp.message.register(admin_delete_message, InAdminTopic(), Command('del', 'delete'))
-    dp.message.register(show_quick_replies, InAdminTopic(), Command('quick'))
-
-    # Пользователи теперь могут писать со слешами — это не мешает операторам
-    dp.message.register(user_message, PrivateChatFilter())
-
-    dp.message.register(admin_message, InAdminTopic(), ~ACommandFilter())
-    dp.edited_message.register(admin_message_edit, InAdminTopic())
-    dp.message.register(admin_sync_message, InAdminTopic(), Command('sync', 'resend'))
-    dp.message.register(admin_delete_message, InAdminTopic(), Command('del', 'delete'))
-    dp.message.register(admin_ban_user, InAdminTopic(), Command('ban'))
-    dp.message.register(admin_stats_command, InAdminGroup(), Command('stats', 'stats_week', 'stats_today'))
-    dp.message.register(show_quick_replies, InAdminTopic(), Command('quick'))
-
-    # Пользователи теперь могут писать со слешами — это не мешает операторам
-    dp.message.register(user_message, PrivateChatFilter())
-
-    dp.message.register(admin_message, InAdminTopic(), ~ACommandFilter())
-    dp.edited_message.register(admin_message_edit, InAdminTopic())
-    dp.message.register(admin_sync_message, InAdminTopic(), Command('sync', 'resend'))
-    dp.message.register(admin_delete_message, InAdminTopic(), Command('del', 'delete'))
-    dp.message.register(admin_ban_user, InAdminTopic(), Command('ban'))
-    dp.message.register(admin_stats_command, InAdminGroup(), Command('stats', 'stats_week', 'stats_today', 'stats_month'))
-    dp.message.register(admin_stats_command, InAdminTopic(), Command('stats', 'stats_week', 'stats_today', 'stats_month'))
-    dp.message.register(show_quick_replies, InAdminTopic(), Command('quick'))
-
-    # Пользователи теперь могут писать со слешами — это не мешает операторам
-    dp.message.register(user_message, PrivateChatFilter())
-
-    dp.message.register(admin_message, InAdminTopic(), ~ACommandFilter())
-    dp.edited_message.register(admin_message_edit, InAdminTopic())
-    dp.message.register(admin_sync_message, InAdminTopic(), Command('sync', 'resend'))
-    dp.message.register(admin_delete_message, InAdminTopic(), Command('del', 'delete'))
-    dp.message.register(admin_ban_user, InAdminTopic(), Command('ban'))
-    dp.message.register(admin_stats_command, InAdminGroup(), Command('stats', 'stats_week', 'stats_today', 'stats_month'))
-    dp.message.register(admin_stats_command, InAdminTopic(), Command('stats', 'stats_week', 'stats_today', 'stats_month'))
-    dp.message.register(show_quick_replies, InAdminTopic(), Command('quick'))
-
-    # Пользователи теперь могут писать со слешами — это не мешает операторам
-    dp.message.register(user_message, PrivateChatFilter())
-
-    dp.message.register(admin_message, InAdminTopic(), ~ACommandFilter())
-    dp.edited_message.register(admin_message_edit, InAdminTopic())
-    dp.message.register(admin_sync_message, InAdminTopic(), Command('sync', 'resend'))
-    dp.message.register(admin_delete_message, InAdminTopic(), Command('del', 'delete'))
-    dp.message.register(admin_ban_user, InAdminTopic(), Command('ban'))
-    dp.message.register(admin_stats_command, InAdminGroup(), Command('stats', 'stats_week', 'stats_today', 'stats_month'))
-    dp.message.register(admin_stats_command, InAdminTopic(), Command('stats', 'stats_week', 'stats_today', 'stats_month'))
-    dp.message.register(show_quick_replies, InAdminTopic(), Command('quick'))
-
-    # Пользователи теперь могут писать со слешами — это не мешает операторам
-    dp.message.register(user_message, PrivateChatFilter())
 
-    dp.message.register(admin_message, InAdminTopic(), ~ACommandFilter())
-    dp.edited_message.register(admin_message_edit, InAdminTopic())
-    dp.message.register(admin_sync_message, InAdminTopic(), Command('sync', 'resend'))
-    dp.message.register(admin_delete_message, InAdminTopic(), Command('del', 'delete'))
-    dp.message.register(admin_ban_user, InAdminTopic(), Command('ban'))
-    dp.message.register(admin_stats_command, InAdminGroup(), Command('stats', 'stats_week', 'stats_today', 'stats_month'))
-    dp.message.register(admin_stats_command, InAdminTopic(), Command('stats', 'stats_week', 'stats_today', 'stats_month'))
-    dp.message.register(show_quick_replies, InAdminTopic(), Command('quick'))
+# filters are stateless, so each one is shared by all its handlers
+_PRIVATE = PrivateChatFilter()
+_IN_ADMIN_GROUP = InAdminGroup()
+_IN_ADMIN_TOPIC = InAdminTopic()
+_BTN_IN_ADMIN_GROUP = BtnInAdminGroup()
+_STATS_CMD = Command(*STATS_PERIODS)
 
-    # Пользователи теперь могут писать со слешами — это не мешает операторам
-    dp.message.register(user_message, PrivateChatFilter())
-
-    dp.message.register(admin_message, InAdminTopic(), ~ACommandFilter())
-    dp.edited_message.register(admin_message_edit, InAdminTopic())
-    dp.message.register(admin_sync_message, InAdminTopic(), Command('sync', 'resend'))
-    dp.message.register(admin_delete_message, InAdminTopic(), Command('del', 'delete'))
-    dp.message.register(admin_ban_user, InAdminTopic(), Command('ban'))
-    dp.message.register(admin_stats_command, InAdminGroup(), Command('stats', 'stats_week', 'stats_today', 'stats_month'))
-    dp.message.register(admin_stats_command, InAdminTopic(), Command('stats', 'stats_week', 'stats_today', 'stats_month'))
-    dp.message.register(show_quick_replies, InAdminTopic(), Command('quick'))
+# (event, handler, filters) in the order aiogram should try them
+HANDLERS = (
+    # Commands first so /start не перехватывается как обычное сообщение
+    ('message', cmd_start, (_PRIVATE, Command('start'))),
+    ('message', show_quick_replies, (_IN_ADMIN_TOPIC, Command('quick'))),
 
     # Пользователи теперь могут писать со слешами — это не мешает операторам
-    dp.message.register(user_message, PrivateChatFilter())
-
-    dp.message.register(admin_message, InAdminTopic(), ~ACommandFilter())
-    dp.edited_message.register(admin_message_edit, InAdminTopic())
-    dp.message.register(admin_sync_message, InAdminTopic(), Command('sync', 'resend'))
-    dp.message.register(admin_delete_message, InAdminTopic(), Command('del', 'delete'))
-    dp.message.register(admin_ban_user, InAdminTopic(), Command('ban'))
-    dp.message.register(admin_stats_command, InAdminGroup(), Command('stats', 'stats_week', 'stats_today', 'stats_month'))
-    dp.message.register(admin_stats_command, InAdminTopic(), Command('stats', 'stats_week', 'stats_today', 'stats_month'))
-    dp.message.register(show_quick_replies, InAdminTopic(), Command('quick'))
+    ('message', user_message, (_PRIVATE,)),
+
+    ('message', admin_message, (_IN_ADMIN_TOPIC, ~ACommandFilter())),
+    ('edited_message', admin_message_edit, (_IN_ADMIN_TOPIC,)),
+    ('message', admin_delete_message, (_IN_ADMIN_TOPIC, Command('del', 'delete'))),
+    ('message', admin_sync_message, (_IN_ADMIN_TOPIC, Command('sync', 'resend'))),
+    ('message', admin_ban_user, (_IN_ADMIN_TOPIC, Command('ban'))),
+    ('message', admin_unban_user, (_IN_ADMIN_TOPIC, Command('unban'))),
+    ('message', admin_stats_command, (_IN_ADMIN_GROUP, _STATS_CMD)),
+    ('message', admin_stats_command, (_IN_ADMIN_TOPIC, _STATS_CMD)),
+
+    ('message', added_to_group, (NewChatMembersFilter(),)),
+    ('message', group_chat_created, (GroupChatCreatedFilter(),)),
+    ('message', mention_in_admin_group, (_IN_ADMIN_GROUP, BotMention())),
+
+    ('message', admin_broadcast_ask_confirm, (BroadcastForm.message,)),
+    ('callback_query', admin_broadcast_finish, (BroadcastForm.confirm, _BTN_IN_ADMIN_GROUP)),
+
+    ('callback_query', admin_quick_reply_handler, (BtnInAdminTopic(),)),
+    ('callback_query', user_btn_handler, (BtnInPrivateChat(),)),
+    ('callback_query', admin_btn_handler, (_BTN_IN_ADMIN_GROUP,)),
+)
 
-    # Пользователи теперь могут писать со слешами — это не мешает операторам
-    dp.message.register(user_message, PrivateChatFilter())
 
-    dp.message.register(admin_message, InAdminTopic(), ~ACommandFilter())
-    dp.edited_message.register(admin_message_edit, InAdminTopic())
-    dp.message.register(admin_sync_message, InAdminTopic(), Command('sync', 'resend'))
-    dp.message.register(admin_delete_message, InAdminTopic(), Command('del', 'delete'))
-    dp.message.register(admin_ban_user, InAdminTopic(), Command('ban'))
-    dp.message.register(admin_stats_command, InAdminGroup(), Command('stats', 'stats_week', 'stats_today', 'stats_month'))
-    dp.message.register(admin_stats_command, InAdminTopic(), Command('stats', 'stats_week', 'stats_today', 'stats_month'))
-    dp.message.register(show_quick_replies, InAdminTopic(), Command('quick'))
+def register_handlers(dp: Dispatcher) -> None:
+    """
+    Register all the handlers to the provided dispatcher
+    """
+    for event, handler, filters in HANDLERS:
+        getattr(dp, event).register(handler, *filters)
 
-    # Пользователи теперь могут писать со слешами — это не мешает операторам
-    dp.message.register(user_message, PrivateChatFilter())
-
-    dp.message.register(admin_message, InAdminTopic(), ~ACommandFilter())
-    dp.edited_message.register(admin_message_edit, InAdminTopic())
-    dp.message.register(admin_sync_message, InAdminTopic(), Command('sync', 'resend'))
-    dp.message.register(admin_delete_message, InAdminTopic(), Command('del', 'delete'))
-    dp.message.register(admin_ban_user, InAdminTopic(), Command('ban'))
-    dp.message.register(admin_unban_user, InAdminTopic(), Command('unban'))
-    dp.message.register(admin_stats_command, InAdminGroup(), Command('stats', 'stats_week', 'stats_today', 'stats_month'))
-    dp.message.register(admin_stats_command, InAdminTopic(), Command('stats', 'stats_week', 'stats_today', 'stats_month'))
-    dp.message.register(show_quick_replies, InAdminTopic(), Command('quick'))
-
-    dp.message.register(added_to_group, NewChatMembersFilter())
-    dp.message.register(group_chat_created, GroupChatCreatedFilter())
-    dp.message.register(mention_in_admin_group, BotMention(), InAdminGroup())
-
-    dp.message.register(admin_broadcast_ask_confirm, BroadcastForm.message)
-    dp.callback_query.register(admin_broadcast_finish, BroadcastForm.confirm, BtnInAdminGroup())
-
-    dp.callback_query.register(admin_quick_reply_handler, BtnInAdminTopic())
-    dp.callback_query.register(user_btn_handler, BtnInPrivateChat())
-    dp.callback_query.register(admin_btn_handler, BtnInAdminGroup())
+    for observer in dp.message, dp.edited_message, dp.callback_query:
+        observer.middleware(LogHandlers())
+    dp.errors.register(handle_error)
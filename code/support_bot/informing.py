@@ -2,9 +2,12 @@
 A package for system messages:
 technical informing in chats, writing logs
 """
+import asyncio
 import datetime
+import re
 
 import aiogram.types as agtypes
+from aiogram import BaseMiddleware
 from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
 
 from .enums import ActionName
@@ -12,6 +15,19 @@ from .gsheets import gsheets_save_admin_message, gsheets_save_user_message
 from .common_utils import make_short_user_info
 
 
+# Telegram error when the bot isn't allowed to create a topic for a new user
+_NO_TOPIC_RIGHTS = re.compile('not enough rights to create a topic', re.IGNORECASE)
+
+EPOCH = datetime.date(1970, 1, 1)  # the start of "lifetime" stats
+LIFETIME_TITLE = 'Всего за всё время'
+# period of scheduled stats: today → (from_date, title)
+_SCHEDULED_PERIODS = {
+    'week': lambda today: (today - datetime.timedelta(days=6), 'Статистика за неделю'),
+    'month': lambda today: (today.replace(day=1), 'Статистика за месяц'),
+    'lifetime': lambda today: (EPOCH, LIFETIME_TITLE),
+}
+
+
 def log(func):
     """
     Decorator. Logs actions
@@ -24,35 +40,43 @@ def log(func):
     return wrapper
 
 
-def handle_error(func):
+class LogHandlers(BaseMiddleware):
     """
-    Decorator. Processes any exception in a handler
+    Middleware. Logs which handler processes an event, in one place for all the handlers
     """
-    async def wrapper(msg: agtypes.Message, *args, **kwargs):
-        try:
-            return await func(msg, *args, **kwargs)
-        except TelegramForbiddenError:
-            await report_user_ban(msg, func)
-        except TelegramBadRequest as exc:
-            if 'not enough rights to create a topic' in exc.message:
-                await report_cant_create_topic(msg)
-        except Exception as exc:
-            await msg.bot.log_error(exc)
+    async def __call__(self, handler, event: agtypes.TelegramObject, data: dict):
+        await data['bot'].log(data['handler'].callback.__name__)
+        return await handler(event, data)
 
-    wrapper.__name__ = func.__name__
-    return wrapper
+
+async def handle_error(event: agtypes.ErrorEvent, bot, *args, **kwargs) -> None:
+    """
+    Processes any exception in a handler.
+    Registered once on the dispatcher, so the handlers themselves aren't wrapped.
+    """
+    exc, msg = event.exception, event.update.event
+    if isinstance(msg, agtypes.CallbackQuery):
+        msg = msg.message
+
+    if isinstance(exc, TelegramForbiddenError):
+        await report_user_ban(msg)
+    elif isinstance(exc, TelegramBadRequest):
+        if _NO_TOPIC_RIGHTS.search(exc.message):
+            await report_cant_create_topic(msg)
+    else:
+        await bot.log_error(exc)
 
 
 @log
-async def report_user_ban(msg: agtypes.Message, func) -> None:
+async def report_user_ban(msg: agtypes.Message) -> None:
     """
-    Report when the user banned the bot
+    Report when the user banned the bot, if it happened while answering in their topic
     """
     bot = msg.bot
     thread_id = msg.message_thread_id
 
-    if func.__name__ == 'admin_message' and await bot.db.tguser.get(thread_id=thread_id):
-        group_id = bot.cfg['admin_group_id']
+    if msg.chat.id == bot.admin_group_id and thread_id and await bot.db.tguser.get(thread_id=thread_id):
+        group_id = bot.admin_group_id
         await bot.send_message(
             group_id, 'The user banned the bot', message_thread_id=thread_id,
         )
@@ -66,7 +90,7 @@ async def report_cant_create_topic(msg: agtypes.Message) -> None:
     user = msg.chat
 
     await msg.bot.send_message(
-        msg.bot.cfg['admin_group_id'],
+        msg.bot.admin_group_id,
         (f'New user <b>{make_short_user_info(user=user)}</b> writes to the bot, '
          'but the bot has not enough rights to create a topic.\n\n️️️❗ '
          'Make the bot admin, and give it a "Manage topics" permission.'),
@@ -78,10 +102,8 @@ async def save_admin_message(msg: agtypes.Message, tguser) -> None:
     Entrypoint for all the mechanisms of saving messages sent by admin.
     There is only one currently: Google Sheets.
     """
-    gsheets_cred_file = msg.bot.cfg.get('save_messages_gsheets_cred_file', None)
-    gsheets_filename = msg.bot.cfg.get('save_messages_gsheets_filename', None)
-    if gsheets_cred_file and gsheets_filename:
-        await gsheets_save_admin_message(msg, tguser)
+    if msg.bot.gsheets_enabled:  # the reply is already delivered, don't keep the handler waiting
+        msg.bot.spawn(gsheets_save_admin_message(msg, tguser))
 
 
 async def save_user_message(
@@ -95,57 +117,37 @@ async def save_user_message(
     """
     bot = msg.bot
 
-    gsheets_cred_file = bot.cfg.get('save_messages_gsheets_cred_file', None)
-    gsheets_filename = bot.cfg.get('save_messages_gsheets_filename', None)
-    if gsheets_cred_file and gsheets_filename:
-        await gsheets_save_user_message(msg, highlight=new_user)
+    if bot.gsheets_enabled:  # the message is already forwarded, don't keep the handler waiting
+        bot.spawn(gsheets_save_user_message(msg, highlight=new_user))
 
     if stat:
-        await bot.db.action.add(ActionName.user_message)
+        bot.db.action.bump(ActionName.user_message)
     if new_user:
-        await bot.db.action.add(ActionName.new_user)
-
+        bot.db.action.bump(ActionName.new_user)
 
-def _format_admin_rows(rows: list) -> str:
-    if not rows:
-        return '—'
 
-    lines = []
-    for _, name, replies, edits, deletes in rows:
-        parts = [f"✉️ {replies or 0}"]
-        if edits:
-            parts.append(f"✏️ {edits}")
-        if deletes:
-            parts.append(f"🗑️ {deletes}")
-        lines.append(f"• <b>{name}</b> — " + ', '.join(parts))
-    return '\n'.join(lines)
+def _format_counts(replies: int | None, edits: int | None, deletes: int | None) -> str:
+    return f"✉️ {replies or 0}" + (f", ✏️ {edits}" if edits else '') + (f", 🗑️ {deletes}" if deletes else '')
 
 
 async def build_stats_report(bot, from_date: datetime.date, to_date: datetime.date | None = None, title: str = '') -> str:
     to_date = to_date or datetime.date.today()
     header = f"<b>{title}</b> ({from_date} — {to_date})" if title else f"Статистика {from_date} — {to_date}"
 
-    actions = await bot.db.action.get_grouped(from_date, to_date)
+    actions, (admin_rows, admin_totals) = await asyncio.gather(
+        bot.db.action.get_grouped(from_date, to_date),
+        bot.db.adminstats.get_range_with_totals(from_date, to_date),
+    )
     action_map = {row[0]: row[1] for row in actions}
 
-    admin_rows = await bot.db.adminstats.get_range(from_date, to_date)
-    total_replies = sum(row[2] or 0 for row in admin_rows)
-    total_edits = sum(row[3] or 0 for row in admin_rows)
-    total_deletes = sum(row[4] or 0 for row in admin_rows)
-
     msg = [header]
     msg.append('\n<b>Пользователи</b>')
     msg.append(f"• Новых: {action_map.get(ActionName.new_user, 0) or 0}")
     msg.append(f"• Сообщений: {action_map.get(ActionName.user_message, 0) or 0}")
 
     msg.append('\n<b>Админы</b>')
-    totals = [f"✉️ {total_replies}"]
-    if total_edits:
-        totals.append(f"✏️ {total_edits}")
-    if total_deletes:
-        totals.append(f"🗑️ {total_deletes}")
-    msg.append('Всего: ' + ', '.join(totals))
-    msg.append(_format_admin_rows(admin_rows))
+    msg.append('Всего: ' + _format_counts(*admin_totals))
+    msg.append('\n'.join(f"• <b>{name}</b> — {_format_counts(*counts)}" for _, name, *counts in admin_rows) or '—')
 
     msg.append('\n<b>Системные метки</b>')
     msg.append('#stats')
@@ -159,22 +161,15 @@ async def stats_to_admin_chat(bots: list, period: str = 'week') -> None:
     period: 'week' | 'month' | 'lifetime'
     """
 
-    today = datetime.date.today()
-
-    if period == 'month':
-        from_date = today.replace(day=1)
-        title = 'Статистика за месяц'
-    elif period == 'lifetime':
-        from_date = datetime.date(1970, 1, 1)
-        title = 'Всего за всё время'
-    else:  # week
-        from_date = today - datetime.timedelta(days=6)
-        title = 'Статистика за неделю'
-
-    for bot in bots:
-        main_msg = await build_stats_report(bot, from_date, title=title)
-        lifetime_msg = ''
+    from_date, title = _SCHEDULED_PERIODS.get(period, _SCHEDULED_PERIODS['week'])(datetime.date.today())
+
+    async def _push(bot) -> None:
+        reports = [build_stats_report(bot, from_date, title=title)]
         if period != 'lifetime':
-            lifetime_msg = '\n\n' + await build_stats_report(bot, datetime.date(1970, 1, 1), title='Всего за всё время')
+            reports.append(build_stats_report(bot, EPOCH, title=LIFETIME_TITLE))
+        try:
+            await bot.send_to_stats_topic('\n\n'.join(await asyncio.gather(*reports)))
+        except Exception as exc:  # one failing bot shouldn't keep the others' stats from being sent
+            await bot.log_error(exc)
 
-        await bot.send_to_stats_topic(f"{main_msg}{lifetime_msg}")
+    await asyncio.gather(*(_push(bot) for bot in bots))
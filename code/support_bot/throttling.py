@@ -0,0 +1,96 @@
+"""
+Shape outbound Telegram requests to the Bot API flood limits,
+and keep their connections open between bursts
+"""
+import asyncio
+
+import aiogram.methods
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import GetUpdates, SendChatAction
+
+# methods posting a message to a chat, the only ones Telegram limits per chat
+_POSTING_METHODS = tuple(
+    cls for name, cls in vars(aiogram.methods).items()
+    if name.startswith(('Send', 'Copy', 'Forward')) and isinstance(cls, type) and cls is not SendChatAction
+)
+
+
+class _Bucket:
+    """
+    Token bucket for `rate` requests per `period` seconds, bursts up to `rate`.
+    Kept as a single timestamp (GCRA), so a slot is reserved before sleeping
+    and concurrent callers need no lock.
+    """
+    def __init__(self, rate: int, period: float):
+        self._interval = period / rate
+        self._burst = period - self._interval
+        self._tat: dict = {}  # key → theoretical arrival time of the next request
+
+    def delay(self, key=None) -> float:
+        """
+        Reserve a slot for a request, return how long to wait for it
+        """
+        now = asyncio.get_running_loop().time()
+        if len(self._tat) > 10000:  # forget keys idle long enough to have a full bucket
+            self._tat = {k: tat for k, tat in self._tat.items() if tat > now}
+
+        tat = max(self._tat.get(key, now), now)
+        self._tat[key] = tat + self._interval
+        return max(tat - self._burst - now, 0)
+
+
+class RateLimiter(BaseRequestMiddleware):
+    """
+    Keep under 30 requests/s overall and 1 message/s per private chat,
+    and wait out a RetryAfter instead of failing the handler.
+    Reads, edits and deletes only count towards the overall limit.
+
+    Group chats aren't shaped per chat: all user topics share the admin group,
+    and Telegram's 20/min there is soft, so RetryAfter handling covers it.
+    """
+    def __init__(self, overall: int = 30, per_chat: int = 1, max_retries: int = 3):
+        self._overall = _Bucket(overall, 1)
+        self._per_chat = _Bucket(per_chat, 1)
+        self._max_retries = max_retries
+
+    async def _wait(self, method) -> None:
+        delay = 0
+        if isinstance(method, _POSTING_METHODS):
+            chat_id = getattr(method, 'chat_id', None)
+            if isinstance(chat_id, int) and chat_id > 0:
+                delay = self._per_chat.delay(chat_id)
+        if delay:
+            await asyncio.sleep(delay)
+        if delay := self._overall.delay():
+            await asyncio.sleep(delay)
+
+    async def __call__(self, make_request, bot, method):
+        if isinstance(method, GetUpdates):  # long polling isn't limited
+            return await make_request(bot, method)
+
+        for attempt in range(self._max_retries + 1):
+            await self._wait(method)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as exc:
+                if attempt == self._max_retries:
+                    raise
+                await asyncio.sleep(exc.retry_after)
+
+
+class KeepAliveSession(AiohttpSession):
+    """
+    AiohttpSession which keeps idle Bot API connections for longer than aiohttp's 15 s,
+    so the scheduled bursts (stats, destruction, broadcasts) don't start with TLS handshakes.
+
+    A session per bot, not one for all of them: the RateLimiter of a bot is attached to its session,
+    and the Bot API limits are per token.
+    """
+    def __init__(self, keepalive_timeout: float = 75, **kwargs):
+        super().__init__(**kwargs)
+        # AiohttpSession takes no connector arguments, so this goes through its private
+        # _connector_init, which create_session() passes to TCPConnector.
+        # Checked against the aiogram pinned in requirements.txt (3.18.0), recheck on upgrades
+        self._connector_init['keepalive_timeout'] = keepalive_timeout
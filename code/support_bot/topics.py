@@ -1,3 +1,5 @@
+import asyncio
+
 import aiogram.types as agtypes
 
 from .utils import make_user_info
@@ -7,26 +9,17 @@ async def create_user_topic(msg: agtypes.Message, tguser=None) -> int:
     """Create a fresh topic for the user and drop quick replies if configured."""
 
     bot = msg.bot
-    group_id = bot.cfg['admin_group_id']
+    group_id = bot.admin_group_id
     user = msg.chat
 
-    response = await bot.create_forum_topic(group_id, user.full_name)
+    # the user card doesn't depend on the topic, so getChat runs alongside createForumTopic
+    response, text = await asyncio.gather(
+        bot.create_forum_topic(group_id, user.full_name),
+        make_user_info(user, bot=bot, tguser=tguser),
+    )
     thread_id = response.message_thread_id
 
-    text = await make_user_info(user, bot=bot, tguser=tguser)
-
     await bot.send_message(group_id, text, message_thread_id=thread_id)
 
-    if bot.admin_quick_replies:
-        # Lazy import to avoid circular dependency on import time
-        from .buttons import send_new_msg_with_keyboard
-
-        await send_new_msg_with_keyboard(
-            bot,
-            bot.cfg['admin_group_id'],
-            '⚡ Быстрые ответы для оператора',
-            bot.admin_quick_replies,
-            message_thread_id=thread_id,
-        )
-
+    await bot.send_quick_replies(thread_id)
     return thread_id